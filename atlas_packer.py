@@ -0,0 +1,143 @@
+from typing import Dict, List, NamedTuple, Optional, Sequence, Tuple
+
+_Rect = Tuple[int, int, int, int]
+
+
+class Placement(NamedTuple):
+    key: str
+    page: int
+    x: int
+    y: int
+    width: int
+    height: int
+    rotated: bool
+
+
+class MaxRectsBin:
+    """Одна страница атласа, упаковка MaxRects с эвристикой Best Short Side Fit.
+
+    Хранит список максимальных свободных прямоугольников; каждое размещение
+    режет пересекающиеся свободные области и выбрасывает вложенные.
+    Вложенность проверяется только для новых кусков: нетронутые области
+    друг в друга не вложены (список и так был очищен).
+    """
+
+    def __init__(self, width: int, height: int, allow_rotation: bool = False) -> None:
+        self.width = width
+        self.height = height
+        self.allow_rotation = allow_rotation
+        self.free: List[_Rect] = [(0, 0, width, height)]
+        self.used_width = 0
+        self.used_height = 0
+
+    def _find(self, w: int, h: int) -> Optional[Tuple[int, int, int, int, bool]]:
+        best: Optional[Tuple[int, int, int, int, bool]] = None
+        best_score = (self.width + self.height + 1, 0)
+        options = [(w, h, False)]
+        if self.allow_rotation and w != h:
+            options.append((h, w, True))
+        for fx, fy, fw, fh in self.free:
+            for rw, rh, rotated in options:
+                if rw > fw or rh > fh:
+                    continue
+                short_side = min(fw - rw, fh - rh)
+                long_side = max(fw - rw, fh - rh)
+                score = (short_side, long_side)
+                if score < best_score:
+                    best_score = score
+                    best = (fx, fy, rw, rh, rotated)
+        return best
+
+    def _split(self, placed: _Rect) -> None:
+        px, py, pw, ph = placed
+        kept: List[_Rect] = []
+        pieces: List[_Rect] = []
+        for fx, fy, fw, fh in self.free:
+            if px >= fx + fw or px + pw <= fx or py >= fy + fh or py + ph <= fy:
+                kept.append((fx, fy, fw, fh))
+                continue
+            if px > fx:
+                pieces.append((fx, fy, px - fx, fh))
+            if px + pw < fx + fw:
+                pieces.append((px + pw, fy, fx + fw - px - pw, fh))
+            if py > fy:
+                pieces.append((fx, fy, fw, py - fy))
+            if py + ph < fy + fh:
+                pieces.append((fx, py + ph, fw, fy + fh - py - ph))
+
+        # Новый кусок выбрасываем, если он внутри нетронутой области или
+        # другого куска (из равных оставляем первый). Обратное невозможно:
+        # нетронутая область внутри куска была бы внутри разрезанной.
+        self.free = kept + [
+            rect
+            for i, rect in enumerate(pieces)
+            if not any(_contains(other, rect) for other in kept)
+            and not any(
+                j != i and _contains(other, rect) and (other != rect or j < i)
+                for j, other in enumerate(pieces)
+            )
+        ]
+
+    def insert(self, w: int, h: int) -> Optional[Tuple[int, int, int, int, bool]]:
+        """Размещает w x h, возвращает (x, y, w, h, rotated) или None, если места нет."""
+
+        found = self._find(w, h)
+        if found is None:
+            return None
+        x, y, rw, rh, _rotated = found
+        self._split((x, y, rw, rh))
+        self.used_width = max(self.used_width, x + rw)
+        self.used_height = max(self.used_height, y + rh)
+        return found
+
+
+def _contains(outer: _Rect, inner: _Rect) -> bool:
+    ox, oy, ow, oh = outer
+    ix, iy, iw, ih = inner
+    return ox <= ix and oy <= iy and ix + iw <= ox + ow and iy + ih <= oy + oh
+
+
+def pack_rects(
+    sizes: Sequence[Tuple[str, int, int]],
+    max_size: Tuple[int, int],
+    padding: int = 0,
+    allow_rotation: bool = False,
+    open_pages: int = 4,
+) -> Tuple[List[Placement], List[Tuple[int, int]]]:
+    """Раскладывает (ключ, w, h) по страницам не больше max_size.
+
+    Возвращает размещения (без учёта padding в width/height) и фактические
+    размеры страниц, обрезанные по занятой области. Крупные прямоугольники
+    идут первыми, при равенстве — по ключу, так что раскладка стабильна.
+    Места ищутся только на последних open_pages страницах: более ранние
+    уже почти заполнены, а перебор всех страниц на длинном захвате
+    делает упаковку квадратичной по числу страниц.
+    """
+
+    max_w, max_h = max_size
+    order = sorted(sizes, key=lambda item: (-max(item[1], item[2]), -item[1] * item[2], item[0]))
+    bins: List[MaxRectsBin] = []
+    placements: Dict[str, Placement] = {}
+
+    for key, w, h in order:
+        pw, ph = w + padding, h + padding
+        fits = (pw <= max_w and ph <= max_h) or (allow_rotation and ph <= max_w and pw <= max_h)
+        if not fits:
+            raise ValueError(f"Кадр {key} ({w}x{h}) не помещается в страницу {max_w}x{max_h}")
+
+        for page in range(max(0, len(bins) - max(1, open_pages)), len(bins)):
+            spot = bins[page].insert(pw, ph)
+            if spot is not None:
+                break
+        else:
+            bins.append(MaxRectsBin(max_w, max_h, allow_rotation))
+            page = len(bins) - 1
+            spot = bins[page].insert(pw, ph)
+            assert spot is not None
+
+        x, y, _rw, _rh, rotated = spot
+        placements[key] = Placement(key, page, x, y, h if rotated else w, w if rotated else h, rotated)
+
+    ordered = [placements[key] for key, _w, _h in sizes]
+    pages = [(max(1, b.used_width - padding), max(1, b.used_height - padding)) for b in bins]
+    return ordered, pages
@@ -0,0 +1,291 @@
+"""Пакетная сборка многих захватов: один индекс спрайтов и общий пул процессов.
+
+Запуск: python batch_render.py "captures/capture_*.json" [--sprites sprites] [--out batch_out]
+
+Для каждого захвата пишутся ПАПКА/<имя>/кадр.png и ПАПКА/<имя>/<имя>.gif,
+в конце — сводка по пропускной способности (и в ПАПКА/summary.json).
+"""
+
+import os
+import glob
+import heapq
+import json
+import time
+import argparse
+from concurrent.futures import FIRST_COMPLETED, Future, ProcessPoolExecutor, wait
+from typing import Dict, List, Optional, Tuple
+
+from PIL import Image
+
+from from_json_to_frame import (
+    FRAME_WORKERS,
+    GIF_DELTA_FRAMES,
+    SPRITES_DIR,
+    GifStreamWriter,
+    RenderPlan,
+    SpriteCache,
+    compile_render_plan,
+    format_cache_stats,
+    index_sprites,
+    load_json,
+    render_frame,
+)
+from profiling import log
+from sprite_store import SpriteStore, open_sprite_store
+
+BATCH_OUTPUT_DIR = "batch_out"
+# Сколько кадров одного захвата уходит воркеру за раз.
+BATCH_CHUNK_FRAMES = 8
+# Сколько пачек может одновременно ждать в пуле на один процесс.
+BATCH_INFLIGHT_PER_WORKER = 4
+# Очерёдность захватов: "small-first" — сначала меньшие файлы, "order" — как в glob.
+BATCH_PRIORITIES = ("small-first", "order")
+BATCH_SUMMARY_NAME = "summary.json"
+
+_Rendered = List[Tuple[str, Image.Image]]
+
+_worker_cache: Optional[SpriteCache] = None
+
+
+def _init_batch_worker(store_path: Optional[str] = None) -> None:
+    global _worker_cache
+    _worker_cache = SpriteCache(store=SpriteStore(store_path) if store_path else None)
+
+
+def _render_chunk(plan: RenderPlan, keys: List[str], output_dir: str) -> _Rendered:
+    """Задача пула: собирает пачку кадров одного захвата и сохраняет их PNG."""
+
+    cache = _worker_cache if _worker_cache is not None else SpriteCache()
+    return [(key, render_frame(key, plan, output_dir, cache)[0]) for key in keys]
+
+
+class CaptureJob:
+    """Один захват в пакете: план сборки и запись GIF строго в порядке кадров.
+
+    Пачки кадров возвращаются из пула в любом порядке; готовые кадры
+    ждут в буфере, пока не подойдёт их очередь в GIF.
+    """
+
+    def __init__(self, json_path: str, output_root: str) -> None:
+        self.json_path = json_path
+        self.name = os.path.splitext(os.path.basename(json_path))[0]
+        self.output_dir = os.path.join(output_root, self.name)
+        self.gif_path = os.path.join(self.output_dir, f"{self.name}.gif")
+        self.frame_keys: List[str] = []
+        self.durations: Dict[str, int] = {}
+        self.plan: Optional[RenderPlan] = None
+        self.writer: Optional[GifStreamWriter] = None
+        self.started = 0.0
+        self.elapsed = 0.0
+        self.error: Optional[str] = None
+        self._ready: Dict[str, Image.Image] = {}
+        self._next = 0
+
+    def open(self, hash_to_path: Dict[str, str]) -> None:
+        self.started = time.perf_counter()
+        data = load_json(self.json_path)
+        frames = data["frames"]
+        self.frame_keys = list(data["meta"]["frame_keys"])
+        self.durations = {key: frames[key].get("duration_ms", 40) for key in self.frame_keys}
+        self.plan = compile_render_plan(frames, hash_to_path, self.frame_keys)
+        os.makedirs(self.output_dir, exist_ok=True)
+        self.writer = GifStreamWriter(self.gif_path, delta=GIF_DELTA_FRAMES)
+
+    def chunks(self, size: int) -> List[List[str]]:
+        return [self.frame_keys[i:i + size] for i in range(0, len(self.frame_keys), size)]
+
+    def chunk_plan(self, keys: List[str]) -> RenderPlan:
+        """План только для этих кадров, чтобы воркеру не пересылать весь захват."""
+
+        plan = self.plan
+        return RenderPlan(plan.sprites, plan.pieces, {key: plan.frames[key] for key in keys})
+
+    @property
+    def done(self) -> bool:
+        return self._next >= len(self.frame_keys)
+
+    def accept(self, rendered: _Rendered) -> None:
+        self._ready.update(rendered)
+        while not self.done and self.frame_keys[self._next] in self._ready:
+            key = self.frame_keys[self._next]
+            self.writer.add(self._ready.pop(key), self.durations[key])
+            self._next += 1
+        if self.done:
+            self.finish()
+
+    def fail(self, error: BaseException) -> None:
+        self.error = f"{type(error).__name__}: {error}"
+        self._ready.clear()
+        self.finish()
+
+    def finish(self) -> None:
+        if self.writer is not None:
+            self.writer.close()
+        self.plan = None
+        self.elapsed = time.perf_counter() - self.started
+
+    def output_bytes(self) -> int:
+        total = 0
+        for key in self.frame_keys:
+            path = os.path.join(self.output_dir, f"{key}.png")
+            if os.path.exists(path):
+                total += os.path.getsize(path)
+        if os.path.exists(self.gif_path):
+            total += os.path.getsize(self.gif_path)
+        return total
+
+
+def render_batch(
+    json_paths: List[str],
+    sprites_dir: str = SPRITES_DIR,
+    output_root: str = BATCH_OUTPUT_DIR,
+    workers: int = FRAME_WORKERS,
+    chunk_frames: int = BATCH_CHUNK_FRAMES,
+    priority: str = "small-first",
+    store_path: Optional[str] = None,
+) -> dict:
+    """Собирает все захваты на общем пуле, возвращает сводку.
+
+    Очередь с приоритетами хранит и «открыть захват», и «собрать пачку».
+    Пачки открытого захвата наследуют его приоритет, поэтому захват
+    дособирается раньше, чем начнётся следующий, а пул не простаивает.
+    """
+
+    batch_start = time.perf_counter()
+    hash_to_path = index_sprites(sprites_dir)
+    store = open_sprite_store(store_path, hash_to_path) if store_path else None
+    os.makedirs(output_root, exist_ok=True)
+
+    jobs = [CaptureJob(path, output_root) for path in json_paths]
+    # (приоритет, номер захвата, номер пачки); пачка -1 — открыть захват
+    queue: List[Tuple[int, int, int]] = []
+    for idx, job in enumerate(jobs):
+        rank = os.path.getsize(job.json_path) if priority == "small-first" else 0
+        queue.append((rank, idx, -1))
+    heapq.heapify(queue)
+    chunks: Dict[int, List[List[str]]] = {}
+
+    pool = (
+        ProcessPoolExecutor(max_workers=workers, initializer=_init_batch_worker, initargs=(store_path,))
+        if workers > 1
+        else None
+    )
+    local_cache = SpriteCache(store=store) if pool is None else None
+    max_inflight = max(1, workers) * BATCH_INFLIGHT_PER_WORKER
+    inflight: Dict[Future, int] = {}
+
+    def run_chunk(idx: int, keys: List[str]) -> None:
+        job = jobs[idx]
+        if pool is None:
+            try:
+                job.accept([(key, render_frame(key, job.plan, job.output_dir, local_cache)[0]) for key in keys])
+            except Exception as e:
+                job.fail(e)
+            return
+        inflight[pool.submit(_render_chunk, job.chunk_plan(keys), keys, job.output_dir)] = idx
+
+    def report(job: CaptureJob) -> None:
+        if job.error is not None:
+            log(f"❌ {job.name}: {job.error}")
+        else:
+            log(f"✅ {job.name}: кадров {len(job.frame_keys)} за {job.elapsed:.2f} с")
+
+    try:
+        while queue or inflight:
+            while queue and len(inflight) < max_inflight:
+                rank, idx, chunk_no = heapq.heappop(queue)
+                job = jobs[idx]
+                if job.error is not None:
+                    continue
+                if chunk_no < 0:
+                    try:
+                        job.open(hash_to_path)
+                    except Exception as e:
+                        job.fail(e)
+                        report(job)
+                        continue
+                    if job.done:
+                        job.finish()
+                        report(job)
+                        continue
+                    chunks[idx] = job.chunks(chunk_frames)
+                    for no in range(len(chunks[idx])):
+                        heapq.heappush(queue, (rank, idx, no))
+                    continue
+                run_chunk(idx, chunks[idx][chunk_no])
+                if job.done or job.error is not None:
+                    chunks.pop(idx, None)
+                    report(job)
+
+            if not inflight:
+                continue
+            finished, _pending = wait(list(inflight), return_when=FIRST_COMPLETED)
+            for future in finished:
+                idx = inflight.pop(future)
+                job = jobs[idx]
+                if job.error is not None:
+                    continue
+                try:
+                    job.accept(future.result())
+                except Exception as e:
+                    job.fail(e)
+                if job.done or job.error is not None:
+                    chunks.pop(idx, None)
+                    report(job)
+    finally:
+        if pool is not None:
+            pool.shutdown(cancel_futures=True)
+
+    elapsed = time.perf_counter() - batch_start
+    frames_total = sum(len(job.frame_keys) for job in jobs if job.error is None)
+    summary = {
+        "captures": len(jobs),
+        "failed": sum(1 for job in jobs if job.error is not None),
+        "frames": frames_total,
+        "seconds": round(elapsed, 3),
+        "frames_per_second": round(frames_total / elapsed, 2) if elapsed else None,
+        "bytes_written": sum(job.output_bytes() for job in jobs if job.error is None),
+        "workers": workers,
+        "per_capture": [
+            {
+                "capture": job.json_path,
+                "frames": len(job.frame_keys),
+                "seconds": round(job.elapsed, 3),
+                "gif": job.gif_path,
+                "error": job.error,
+            }
+            for job in jobs
+        ],
+    }
+    with open(os.path.join(output_root, BATCH_SUMMARY_NAME), "w", encoding="utf-8") as fh:
+        json.dump(summary, fh, ensure_ascii=False, indent=1)
+
+    if local_cache is not None:
+        log(format_cache_stats(local_cache))
+    log(
+        f"📊 Захватов {summary['captures']} (ошибок {summary['failed']}), кадров {frames_total} "
+        f"за {elapsed:.2f} с — {summary['frames_per_second']} кадр/с, "
+        f"записано {summary['bytes_written'] / 2**20:.1f} МБ"
+    )
+    return summary
+
+
+def main(argv=None) -> None:
+    parser = argparse.ArgumentParser(description="Пакетная сборка кадров и GIF для многих захватов.")
+    parser.add_argument("pattern", nargs="+", help='glob захватов, например "captures/capture_*.json"')
+    parser.add_argument("--sprites", default=SPRITES_DIR, help="папка спрайтов (индексируется один раз)")
+    parser.add_argument("--out", default=BATCH_OUTPUT_DIR, help="корневая папка результатов")
+    parser.add_argument("--workers", type=int, default=FRAME_WORKERS, help="процессов в общем пуле")
+    parser.add_argument("--chunk", type=int, default=BATCH_CHUNK_FRAMES, help="кадров в одной задаче")
+    parser.add_argument("--priority", choices=BATCH_PRIORITIES, default="small-first")
+    parser.add_argument("--store", help="mmap-хранилище сырых спрайтов (создаётся при необходимости)")
+    args = parser.parse_args(argv)
+
+    paths = sorted({path for pattern in args.pattern for path in glob.glob(pattern)})
+    if not paths:
+        parser.error("по шаблону не найдено ни одного захвата")
+    render_batch(paths, args.sprites, args.out, args.workers, max(1, args.chunk), args.priority, args.store)
+
+
+if __name__ == "__main__":
+    main()
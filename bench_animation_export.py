@@ -0,0 +1,93 @@
+"""Размер и время кодирования анимации в разных режимах: GIF/APNG, целиком и дельтами.
+
+Запуск: python bench_animation_export.py [capture.json] [папка спрайтов]
+"""
+
+import os
+import sys
+import tempfile
+import time
+from typing import Callable, List, Tuple
+
+from PIL import Image
+
+from from_json_to_frame import (
+    JSON_PATH,
+    SPRITES_DIR,
+    ApngStreamWriter,
+    GifStreamWriter,
+    SpriteCache,
+    index_sprites,
+    iter_rendered_frames,
+    load_json,
+)
+
+MODES: List[Tuple[str, str, Callable[[str], object]]] = [
+    ("GIF (кадр целиком)", ".gif", lambda path: GifStreamWriter(path, delta=False)),
+    ("GIF (дельта)", ".gif", lambda path: GifStreamWriter(path, delta=True)),
+    ("APNG (кадр целиком)", ".apng", lambda path: ApngStreamWriter(path, delta=False)),
+    ("APNG (дельта)", ".apng", lambda path: ApngStreamWriter(path, delta=True)),
+]
+
+
+def save_all_gif(path: str, frames: List[Tuple[Image.Image, int]]) -> int:
+    """Прежний экспорт через Pillow save_all (disposal=2) — точка отсчёта для сравнения."""
+
+    first, *rest = [image for image, _duration in frames]
+    first.save(
+        path,
+        save_all=True,
+        append_images=rest,
+        duration=[duration for _image, duration in frames],
+        loop=0,
+        disposal=2,
+        transparency=0,
+    )
+    with Image.open(path) as gif:
+        return gif.n_frames
+
+
+def render_frames(json_path: str, sprites_dir: str) -> List[Tuple[Image.Image, int]]:
+    data = load_json(json_path)
+    frames = data["frames"]
+    hash_to_path = index_sprites(sprites_dir)
+    rendered = iter_rendered_frames(
+        data["meta"]["frame_keys"], frames, hash_to_path, None, SpriteCache(), incremental=False
+    )
+    return [(img, frames[key].get("duration_ms", 40)) for key, img in rendered]
+
+
+def main() -> None:
+    json_path = sys.argv[1] if len(sys.argv) > 1 else JSON_PATH
+    sprites_dir = sys.argv[2] if len(sys.argv) > 2 else SPRITES_DIR
+    frames = render_frames(json_path, sprites_dir)
+    if not frames:
+        print("❌ Нет кадров для экспорта.")
+        return
+
+    print(f"🎞️ {len(frames)} кадров {frames[0][0].width}x{frames[0][0].height}")
+    with tempfile.TemporaryDirectory() as tmp:
+        for label, ext, make_writer in MODES:
+            path = os.path.join(tmp, "anim" + ext)
+            start = time.perf_counter()
+            with make_writer(path) as writer:
+                for image, duration in frames:
+                    writer.add(image, duration)
+            elapsed = time.perf_counter() - start
+            print(
+                f"{label:<22} {os.path.getsize(path) / 1024:9.1f} КБ  {elapsed:7.3f} с"
+                f"  кадров {writer.frames_written}"
+            )
+
+        path = os.path.join(tmp, "baseline.gif")
+        start = time.perf_counter()
+        written = save_all_gif(path, frames)
+        elapsed = time.perf_counter() - start
+        print(
+            f"{'GIF (Pillow save_all)':<22} {os.path.getsize(path) / 1024:9.1f} КБ  {elapsed:7.3f} с"
+            f"  кадров {written}"
+        )
+
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,124 @@
+"""Сравнение скорости load_json с прежним посимвольным _strip_trailing_commas.
+
+Запуск: python bench_load_json.py [число кадров]
+"""
+
+import json
+import os
+import sys
+import tempfile
+import time
+from typing import Callable
+
+from from_json_to_frame import _strip_trailing_commas, load_json
+
+_WHITESPACE = {" ", "\t", "\r", "\n"}
+
+
+def _strip_trailing_commas_legacy(payload: str) -> str:
+    """Прежняя реализация: посимвольный проход со списком символов."""
+
+    result: list[str] = []
+    in_string = False
+    escape = False
+
+    for ch in payload:
+        if in_string:
+            result.append(ch)
+            if escape:
+                escape = False
+            elif ch == "\\":
+                escape = True
+            elif ch == '"':
+                in_string = False
+            continue
+
+        if ch == '"':
+            in_string = True
+            result.append(ch)
+            continue
+
+        if ch in "]}":
+            idx = len(result) - 1
+            while idx >= 0 and result[idx] in _WHITESPACE:
+                idx -= 1
+            if idx >= 0 and result[idx] == ',':
+                del result[idx]
+            result.append(ch)
+            continue
+
+        result.append(ch)
+
+    return "".join(result)
+
+
+def _load_json_legacy(path: str) -> dict:
+    with open(path, "r", encoding="utf-8") as fh:
+        payload = fh.read()
+
+    try:
+        return json.loads(payload)
+    except json.JSONDecodeError:
+        cleaned = _strip_trailing_commas_legacy(payload)
+        if cleaned != payload:
+            return json.loads(cleaned)
+        raise
+
+
+def make_payload(frame_count: int) -> str:
+    """JSON в стиле экспортёра: запятая после каждого значения, даже последнего."""
+
+    chunks = ['{\n "meta": {\n  "frame_keys": [\n']
+    chunks.extend(f'   "frame_{i:05d}",\n' for i in range(frame_count))
+    chunks.append('  ],\n },\n "frames": {\n')
+    for i in range(frame_count):
+        chunks.append(f'  "frame_{i:05d}": {{\n')
+        chunks.append('   "bounds": {"x": 0, "y": 0, "width": 128, "height": 128,},\n')
+        chunks.append('   "parts": [\n')
+        for order in range(8):
+            chunks.append(
+                '    {"order": %d, "sprite_id": %d, "name": "деталь \\"%d\\", [x]",'
+                ' "sprite_hash": {"value": "%064x",},'
+                ' "source": {"x": 0, "y": 0, "width": 16, "height": 16,},'
+                ' "transform": {"name": "NONE",},'
+                ' "absolute_position": {"x": %d.5, "y": 3.25,},},\n'
+                % (order, 300 + order, order, i * 8 + order, order)
+            )
+        chunks.append('   ],\n   "duration_ms": 40,\n  },\n')
+    chunks.append(' },\n}\n')
+    return "".join(chunks)
+
+
+def _timed(label: str, fn: Callable[[], object], size: int) -> float:
+    start = time.perf_counter()
+    fn()
+    elapsed = time.perf_counter() - start
+    print(f"{label:<28} {elapsed:8.3f} с  {size / elapsed / 2**20:8.1f} МБ/с")
+    return elapsed
+
+
+def main() -> None:
+    frame_count = int(sys.argv[1]) if len(sys.argv) > 1 else 5000
+    payload = make_payload(frame_count)
+    size = len(payload.encode("utf-8"))
+
+    assert _strip_trailing_commas(payload) == _strip_trailing_commas_legacy(payload)
+
+    fd, path = tempfile.mkstemp(suffix=".json")
+    try:
+        with os.fdopen(fd, "w", encoding="utf-8") as fh:
+            fh.write(payload)
+
+        print(f"📄 {frame_count} кадров, {size / 2**20:.1f} МБ")
+        _timed("strip (посимвольно)", lambda: _strip_trailing_commas_legacy(payload), size)
+        _timed("strip (split + re)", lambda: _strip_trailing_commas(payload), size)
+        legacy = _timed("load_json (прежний)", lambda: _load_json_legacy(path), size)
+        fast = _timed("load_json", lambda: load_json(path), size)
+        assert load_json(path) == _load_json_legacy(path)
+        print(f"⚡ Ускорение load_json: ×{legacy / fast:.1f}")
+    finally:
+        os.remove(path)
+
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,407 @@
+"""Бенчмарк стадий конвейера на синтетическом захвате.
+
+Запуск: python bench_pipeline.py [--sprites 200] [--frames 300] [--parts 8]
+                                 [--comma-density 1.0] [--seed 1] [--repeat 3]
+                                 [--out bench_results.json]
+       python bench_pipeline.py --verify-composite [--seed 1]
+
+Генератор детерминирован: при тех же параметрах и seed получаются те же
+спрайты и тот же capture_0001.json. Каждая стадия идёт в отдельном
+процессе, поэтому пиковый RSS относится только к ней и её подготовке.
+Результаты пишутся в JSON, чтобы сравнивать прогоны между коммитами.
+
+--verify-composite вместо замеров сверяет побайтно бэкенды наложения
+"pil" и "numpy" (COMPOSITE_BACKEND) и завершается с кодом 1 при расхождении.
+"""
+
+import os
+import io
+import sys
+import json
+import time
+import random
+import shutil
+import argparse
+import platform
+import tempfile
+import subprocess
+import contextlib
+from concurrent.futures import ProcessPoolExecutor
+from typing import Callable, Dict, List, Optional, Tuple
+
+import PIL
+from PIL import Image
+
+try:
+    import resource
+except ImportError:  # Windows
+    resource = None
+
+import from_json_to_frame as pipeline
+from atlas_packer import pack_rects
+
+TRANSFORMS = (
+    "NONE", "FLIP_H", "FLIP_V", "ROTATE_90", "ROTATE_180", "ROTATE_270",
+    "MIRROR_ROTATE_90", "MIRROR_ROTATE_180", "MIRROR_ROTATE_270",
+)
+
+
+# --------------- ГЕНЕРАТОР ---------------
+def _synthetic_sprite(rng: random.Random, width: int, height: int) -> Image.Image:
+    """Несколько непрозрачных прямоугольников с полупрозрачной каймой на пустом фоне."""
+
+    img = Image.new("RGBA", (width, height), (0, 0, 0, 0))
+    for _ in range(rng.randint(2, 6)):
+        x0, x1 = sorted(rng.sample(range(width + 1), 2))
+        y0, y1 = sorted(rng.sample(range(height + 1), 2))
+        color = (rng.randrange(256), rng.randrange(256), rng.randrange(256))
+        img.paste(color + (rng.choice((128, 255)),), (x0, y0, x1, y1))
+    return img
+
+
+def _with_trailing_commas(payload: str, density: float, rng: random.Random) -> str:
+    """Ставит запятую перед каждой ] и } с вероятностью density, как экспортёр."""
+
+    out: List[str] = []
+    in_string = False
+    escape = False
+    for ch in payload:
+        if in_string:
+            if escape:
+                escape = False
+            elif ch == "\\":
+                escape = True
+            elif ch == '"':
+                in_string = False
+        elif ch == '"':
+            in_string = True
+        elif ch in "]}" and out and out[-1] not in "[{," and rng.random() < density:
+            out.append(",")
+        out.append(ch)
+    return "".join(out)
+
+
+def generate_capture(
+    root: str,
+    sprite_count: int = 200,
+    frame_count: int = 300,
+    parts_per_frame: int = 8,
+    comma_density: float = 1.0,
+    seed: int = 1,
+    canvas_size: Tuple[int, int] = (256, 256),
+) -> str:
+    """Пишет root/sprites/*.png и root/capture_0001.json, возвращает путь к JSON."""
+
+    rng = random.Random(seed)
+    sprites_dir = os.path.join(root, "sprites")
+    os.makedirs(sprites_dir, exist_ok=True)
+
+    sprites: List[Tuple[str, int, int, int]] = []
+    for idx in range(sprite_count):
+        width, height = rng.randint(16, 96), rng.randint(16, 96)
+        img = _synthetic_sprite(rng, width, height)
+        img.save(os.path.join(sprites_dir, f"sprite_{idx:05d}.png"))
+        sprites.append((pipeline.sha256_java_argb(img), width, height, 300 + idx))
+
+    cw, ch = canvas_size
+    frame_keys: List[str] = []
+    frames: Dict[str, dict] = {}
+    for f in range(frame_count):
+        key = f"frame_{f:05d}"
+        frame_keys.append(key)
+        parts = []
+        for order in range(parts_per_frame):
+            digest, width, height, sprite_id = rng.choice(sprites)
+            sx, sy = rng.randrange(width // 2 + 1), rng.randrange(height // 2 + 1)
+            parts.append({
+                "order": order,
+                "sprite_id": sprite_id,
+                "sprite_hash": {"value": digest.upper() if order % 2 else digest},
+                "source": {
+                    "x": sx, "y": sy,
+                    "width": rng.randint(1, width - sx), "height": rng.randint(1, height - sy),
+                },
+                "transform": {"name": rng.choice(TRANSFORMS)},
+                "absolute_position": {"x": rng.uniform(0, cw - 16), "y": rng.uniform(0, ch - 16)},
+            })
+        frames[key] = {
+            "bounds": {"x": 0, "y": 0, "width": cw, "height": ch},
+            "parts": parts,
+            "duration_ms": rng.choice((40, 80)),
+        }
+
+    payload = json.dumps({"meta": {"frame_keys": frame_keys}, "frames": frames}, indent=1, ensure_ascii=False)
+    json_path = os.path.join(root, "capture_0001.json")
+    with open(json_path, "w", encoding="utf-8") as fh:
+        fh.write(_with_trailing_commas(payload, comma_density, rng))
+    return json_path
+
+
+# --------------- СТАДИИ ---------------
+class _Context:
+    """Входы стадии, подготовленные до начала замера."""
+
+    def __init__(self, root: str) -> None:
+        self.root = root
+        self.json_path = os.path.join(root, "capture_0001.json")
+        self.sprites_dir = os.path.join(root, "sprites")
+        self.index_cache = os.path.join(root, "sprites.index.sqlite")
+
+    def data(self) -> dict:
+        return pipeline.load_json(self.json_path)
+
+    def hash_to_path(self) -> Dict[str, str]:
+        return pipeline.index_sprites(self.sprites_dir, self.index_cache)
+
+    def canvases(self) -> List[Tuple[Image.Image, int]]:
+        data = self.data()
+        frames = data["frames"]
+        plan = pipeline.compile_render_plan(frames, self.hash_to_path(), data["meta"]["frame_keys"])
+        cache = pipeline.SpriteCache()
+        return [
+            (pipeline.render_planned_frame(plan, key, cache), frames[key].get("duration_ms", 40))
+            for key in data["meta"]["frame_keys"]
+        ]
+
+
+def _stage_index_cold(ctx: _Context) -> Tuple[Callable[[], object], int, str]:
+    count = len(os.listdir(ctx.sprites_dir))
+    return lambda: pipeline.index_sprites(ctx.sprites_dir, None), count, "спрайтов"
+
+
+def _stage_index_warm(ctx: _Context) -> Tuple[Callable[[], object], int, str]:
+    ctx.hash_to_path()  # заполняет кэш индекса
+    count = len(os.listdir(ctx.sprites_dir))
+    return ctx.hash_to_path, count, "спрайтов"
+
+
+def _stage_load_json(ctx: _Context) -> Tuple[Callable[[], object], int, str]:
+    return ctx.data, os.path.getsize(ctx.json_path), "байт"
+
+
+def _stage_build_frame(ctx: _Context) -> Tuple[Callable[[], object], int, str]:
+    data = ctx.data()
+    frames = data["frames"]
+    keys = data["meta"]["frame_keys"]
+    hash_to_path = ctx.hash_to_path()
+
+    def run() -> None:
+        cache = pipeline.SpriteCache()
+        for key in keys:
+            pipeline.build_frame(key, frames, hash_to_path, cache)
+
+    return run, len(keys), "кадров"
+
+
+def _stage_trim(ctx: _Context) -> Tuple[Callable[[], object], int, str]:
+    canvases = ctx.canvases()
+
+    def run() -> None:
+        for img, _duration in canvases:
+            pipeline.trim_to_content(img)
+
+    return run, len(canvases), "кадров"
+
+
+def _stage_export_gif(ctx: _Context) -> Tuple[Callable[[], object], int, str]:
+    canvases = ctx.canvases()
+    path = os.path.join(ctx.root, "bench.gif")
+    return lambda: pipeline.stream_gif(canvases, path), len(canvases), "кадров"
+
+
+def _stage_spritesheet(ctx: _Context) -> Tuple[Callable[[], object], int, str]:
+    trimmed = [pipeline.trim_to_content(img)[0] for img, _duration in ctx.canvases()]
+
+    def run() -> None:
+        sizes = [(str(i), img.width, img.height) for i, img in enumerate(trimmed)]
+        placements, pages = pack_rects(sizes, (4096, 4096), 2)
+        sheets = [Image.new("RGBA", size, (0, 0, 0, 0)) for size in pages]
+        for img, place in zip(trimmed, placements):
+            sheets[place.page].paste(img, (place.x, place.y))
+        for sheet in sheets:
+            sheet.save(io.BytesIO(), "PNG")
+
+    return run, len(trimmed), "кадров"
+
+
+STAGES: Dict[str, Callable[[_Context], Tuple[Callable[[], object], int, str]]] = {
+    "index_sprites_cold": _stage_index_cold,
+    "index_sprites_warm": _stage_index_warm,
+    "load_json": _stage_load_json,
+    "build_frame": _stage_build_frame,
+    "trim_to_content": _stage_trim,
+    "export_gif": _stage_export_gif,
+    "spritesheet_layout": _stage_spritesheet,
+}
+
+
+# --------------- ПРОВЕРКА НАЛОЖЕНИЯ ---------------
+def verify_composite(root: str, seed: int = 1, blends: int = 500) -> List[str]:
+    """Сравнивает бэкенды "pil" и "numpy" побайтно, возвращает список расхождений.
+
+    Кадры синтетического захвата собираются обоими способами. Кроме того,
+    случайные детали со всеми значениями альфы накладываются на случайный
+    фон, в том числе со смещением за края холста.
+    """
+
+    if not pipeline.NUMPY_AVAILABLE:
+        return ["NumPy не установлен — бэкенд numpy недоступен"]
+    import numpy as np
+
+    mismatches: List[str] = []
+    ctx = _Context(root)
+    data = ctx.data()
+    keys = data["meta"]["frame_keys"]
+    plan = pipeline.compile_render_plan(data["frames"], ctx.hash_to_path(), keys)
+    rendered: Dict[str, List[bytes]] = {}
+    saved_backend = pipeline.COMPOSITE_BACKEND
+    try:
+        for backend in ("pil", "numpy"):
+            pipeline.COMPOSITE_BACKEND = backend
+            cache = pipeline.SpriteCache()
+            rendered[backend] = [
+                pipeline.render_planned_frame(plan, key, cache).tobytes() for key in keys
+            ]
+    finally:
+        pipeline.COMPOSITE_BACKEND = saved_backend
+    for key, pil_bytes, numpy_bytes in zip(keys, rendered["pil"], rendered["numpy"]):
+        if pil_bytes != numpy_bytes:
+            mismatches.append(f"кадр {key}")
+
+    rng = random.Random(seed)
+    blender = pipeline.NumpyBlender()
+    for i in range(blends):
+        cw, ch = rng.randint(1, 48), rng.randint(1, 48)
+        sw, sh = rng.randint(1, 48), rng.randint(1, 48)
+        x, y = rng.randint(-sw, cw), rng.randint(-sh, ch)
+        dst = Image.frombytes("RGBA", (cw, ch), rng.randbytes(cw * ch * 4))
+        src = Image.frombytes("RGBA", (sw, sh), rng.randbytes(sw * sh * 4))
+        canvas = np.array(dst)
+        blender.blend(canvas, np.array(src), x, y)
+        dst.paste(src, (x, y), src)
+        if canvas.tobytes() != dst.tobytes():
+            mismatches.append(f"наложение #{i}: {sw}x{sh} в ({x}, {y}) на {cw}x{ch}")
+    return mismatches
+
+
+def _peak_rss_mb() -> Optional[float]:
+    if resource is None:
+        return None
+    peak = resource.getrusage(resource.RUSAGE_SELF).ru_maxrss
+    # Linux отдаёт КБ, macOS — байты
+    return round(peak / (2**20 if sys.platform == "darwin" else 2**10), 1)
+
+
+def _run_stage(name: str, root: str, repeat: int) -> dict:
+    """Выполняется в отдельном процессе: подготовка, затем repeat замеров."""
+
+    ctx = _Context(root)
+    with contextlib.redirect_stdout(io.StringIO()):
+        run, amount, unit = STAGES[name](ctx)
+        rss_before = _peak_rss_mb()
+        timings = []
+        for _ in range(repeat):
+            start = time.perf_counter()
+            run()
+            timings.append(time.perf_counter() - start)
+    best = min(timings)
+    rss_after = _peak_rss_mb()
+    return {
+        "seconds": round(best, 4),
+        "seconds_all": [round(t, 4) for t in timings],
+        "amount": amount,
+        "unit": unit,
+        "per_second": round(amount / best, 1) if best else None,
+        "peak_rss_mb": rss_after,
+        "stage_rss_growth_mb": round(rss_after - rss_before, 1) if rss_after is not None else None,
+    }
+
+
+def _git_revision() -> Optional[str]:
+    try:
+        out = subprocess.run(
+            ["git", "rev-parse", "--short", "HEAD"],
+            cwd=os.path.dirname(os.path.abspath(__file__)),
+            capture_output=True, text=True, check=True,
+        )
+    except (OSError, subprocess.CalledProcessError):
+        return None
+    return out.stdout.strip()
+
+
+def main(argv=None) -> None:
+    parser = argparse.ArgumentParser(description="Бенчмарк стадий конвейера на синтетическом захвате.")
+    parser.add_argument("--sprites", type=int, default=200, help="число спрайтов")
+    parser.add_argument("--frames", type=int, default=300, help="число кадров")
+    parser.add_argument("--parts", type=int, default=8, help="деталей в кадре")
+    parser.add_argument("--comma-density", type=float, default=1.0,
+                        help="доля ] и } с висячей запятой перед ними (0..1)")
+    parser.add_argument("--seed", type=int, default=1)
+    parser.add_argument("--repeat", type=int, default=3, help="замеров на стадию, берётся лучший")
+    parser.add_argument("--stage", action="append", choices=tuple(STAGES), help="только эти стадии")
+    parser.add_argument("--workdir", help="куда писать синтетический захват (по умолчанию — временная папка)")
+    parser.add_argument("--out", default="bench_results.json", help="JSON с результатами")
+    parser.add_argument("--verify-composite", action="store_true",
+                        help="вместо замеров сверить побайтно наложение pil и numpy")
+    args = parser.parse_args(argv)
+
+    if args.verify_composite:
+        root = args.workdir or tempfile.mkdtemp(prefix="bench_pipeline_")
+        try:
+            generate_capture(root, args.sprites, args.frames, args.parts, args.comma_density, args.seed)
+            with contextlib.redirect_stdout(io.StringIO()):
+                mismatches = verify_composite(root, args.seed)
+        finally:
+            if not args.workdir:
+                shutil.rmtree(root, ignore_errors=True)
+        for line in mismatches[:20]:
+            print(f"❌ {line}")
+        if mismatches:
+            print(f"❌ Расхождений pil/numpy: {len(mismatches)}")
+            sys.exit(1)
+        print(f"✅ pil и numpy совпадают побайтно: {args.frames} кадров и случайные наложения")
+        return
+
+    root = args.workdir or tempfile.mkdtemp(prefix="bench_pipeline_")
+    try:
+        print(f"🧪 Генерируем захват в {root} …")
+        start = time.perf_counter()
+        generate_capture(root, args.sprites, args.frames, args.parts, args.comma_density, args.seed)
+        print(f"   готово за {time.perf_counter() - start:.1f} с")
+
+        results: Dict[str, dict] = {}
+        for name in args.stage or STAGES:
+            # Свежий процесс на стадию: чистый пиковый RSS и холодные кэши
+            with ProcessPoolExecutor(max_workers=1) as pool:
+                result = pool.submit(_run_stage, name, root, max(1, args.repeat)).result()
+            results[name] = result
+            print(
+                f"{name:<20} {result['seconds']:8.3f} с  {result['per_second']:>12} {result['unit']}/с"
+                f"  RSS {result['peak_rss_mb']} МБ"
+            )
+    finally:
+        if not args.workdir:
+            shutil.rmtree(root, ignore_errors=True)
+
+    report = {
+        "revision": _git_revision(),
+        "timestamp": time.strftime("%Y-%m-%dT%H:%M:%S"),
+        "python": platform.python_version(),
+        "pillow": PIL.__version__,
+        "params": {
+            "sprites": args.sprites,
+            "frames": args.frames,
+            "parts": args.parts,
+            "comma_density": args.comma_density,
+            "seed": args.seed,
+            "repeat": args.repeat,
+        },
+        "stages": results,
+    }
+    with open(args.out, "w", encoding="utf-8") as fh:
+        json.dump(report, fh, ensure_ascii=False, indent=1)
+    print(f"💾 Результаты: {args.out}")
+
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,497 @@
+"""Поиск изображений по цвету без интерфейса: библиотека и CLI.
+
+Запуск: python color_search.py ПАПКА FF0000 [00FF00 ...] [--sort name] [--workers 8]
+Результаты печатаются в stdout построчно в JSON, диагностика — в stderr.
+"""
+
+import os
+import re
+import sys
+import array
+import bisect
+import json
+import sqlite3
+import argparse
+import zlib
+from collections import deque
+from concurrent.futures import ProcessPoolExecutor
+from functools import partial
+
+from PIL import Image
+
+from file_scan import scan_files
+
+# NumPy ускоряет поиск цвета; без него работает прежний поиск через set
+try:
+    import numpy as np
+
+    NUMPY_AVAILABLE = True
+except ImportError:
+    NUMPY_AVAILABLE = False
+
+# Константы
+SCAN_CHUNK_PIXELS = 1 << 20  # сколько пикселей проверять за раз до досрочной остановки
+COLOR_INDEX_NAME = ".color_index.sqlite"  # индекс цветов в папке поиска
+COLOR_INDEX_VERSION = 2
+OCCUPANCY_SHIFT = 4  # карта занятости: 256 >> 4 = 16 корзин на канал, 4096 бит
+COLOR_METRICS = {"rgb": "RGB (по каналам)", "ciede2000": "CIEDE2000 (ΔE)"}
+USE_COLOR_INDEX = True
+SEARCH_WORKERS = os.cpu_count() or 1  # процессов для декодирования при поиске
+SUPPORTED_GLOBS = ('*.png', '*.jpg', '*.jpeg', '*.bmp', '*.gif')
+EXCLUDE_GLOBS = ()
+SEARCH_RECURSIVE = True  # искать и во вложенных папках
+SEARCH_MAX_INFLIGHT = 64  # сколько файлов может одновременно ждать декодирования в пуле
+SORT_ORDERS = ("none", "name", "size-desc", "size-asc")
+COLOR_INDEX_BUSY_TIMEOUT = 30.0  # секунд ждать, пока индекс пишет другой процесс
+COLOR_INDEX_COMMIT_EVERY = 64  # записей индекса в одной транзакции
+
+
+def _log(message):
+    print(message, file=sys.stderr)
+
+
+def hex_to_rgb(hex_code):
+    hex_code = hex_code.lstrip('#')
+    if not re.fullmatch(r'[0-9a-fA-F]{6}', hex_code):
+        raise ValueError(f"Неверный формат цвета: '{hex_code}'")
+    return tuple(int(hex_code[i:i + 2], 16) for i in (0, 2, 4))
+
+
+def natural_sort_key(s):
+    return [int(text) if text.isdigit() else text.lower() for text in re.split(r'(\d+)', s)]
+
+
+def sort_results(results, order):
+    """Сортирует результаты так же, как выпадающий список «Сортировка» в интерфейсе."""
+    if order == "size-desc":
+        results.sort(key=lambda item: item[1], reverse=True)
+    elif order == "size-asc":
+        results.sort(key=lambda item: item[1], reverse=False)
+    elif order == "name":
+        results.sort(key=lambda item: natural_sort_key(os.path.basename(item[0])))
+    return results
+
+
+def pack_rgbx(rgb):
+    """Упаковывает (r, g, b) так же, как пиксель RGBX читается в uint32 little-endian."""
+    r, g, b = rgb
+    return r | (g << 8) | (b << 16) | (0xFF << 24)
+
+
+def image_has_colors(img_rgb, colors):
+    """Проверяет, что в RGB-изображении есть все цвета из colors.
+
+    Пиксели упаковываются в uint32 и сравниваются векторно кусками по
+    SCAN_CHUNK_PIXELS; как только найдены все цвета, проверка прекращается.
+    """
+    if not NUMPY_AVAILABLE:
+        image_colors = set(img_rgb.getdata())
+        return all(color in image_colors for color in colors)
+
+    pixels = np.frombuffer(img_rgb.convert('RGBX').tobytes(), dtype='<u4')
+    remaining = {pack_rgbx(color) for color in colors}
+    for start in range(0, pixels.size, SCAN_CHUNK_PIXELS):
+        chunk = pixels[start:start + SCAN_CHUNK_PIXELS]
+        remaining = {value for value in remaining if not (chunk == value).any()}
+        if not remaining:
+            return True
+    return not remaining
+
+
+def distinct_colors(img_rgb):
+    """Возвращает отсортированные упакованные (pack_rgbx) цвета изображения как uint32-байты."""
+    if NUMPY_AVAILABLE:
+        pixels = np.frombuffer(img_rgb.convert('RGBX').tobytes(), dtype='<u4')
+        return np.unique(pixels).astype('<u4').tobytes()
+    width, height = img_rgb.size
+    colors = img_rgb.getcolors(maxcolors=max(1, width * height))
+    return array.array('I', sorted(pack_rgbx(color) for _count, color in colors)).tobytes()
+
+
+def colors_contain(packed_colors, colors):
+    """Бинарный поиск каждого цвета в отсортированном массиве из distinct_colors."""
+    view = memoryview(packed_colors).cast('I')
+    for color in colors:
+        value = pack_rgbx(color)
+        pos = bisect.bisect_left(view, value)
+        if pos == len(view) or view[pos] != value:
+            return False
+    return True
+
+
+def unpack_rgbx(value):
+    return value & 0xFF, (value >> 8) & 0xFF, (value >> 16) & 0xFF
+
+
+def occupancy_map(packed_colors):
+    """Грубая 3D-гистограмма (есть/нет цвета в корзине 16x16x16) как битовая маска 512 байт."""
+    bins = 256 >> OCCUPANCY_SHIFT
+    if NUMPY_AVAILABLE:
+        values = np.frombuffer(packed_colors, dtype='<u4')
+        r, g, b = (values >> OCCUPANCY_SHIFT) & 0xF, (values >> (8 + OCCUPANCY_SHIFT)) & 0xF, (values >> (16 + OCCUPANCY_SHIFT)) & 0xF
+        occupied = np.zeros(bins ** 3, dtype=bool)
+        occupied[(b * bins + g) * bins + r] = True
+        return np.packbits(occupied, bitorder='little').tobytes()
+    occupied = bytearray(bins ** 3 // 8)
+    for value in memoryview(packed_colors).cast('I'):
+        r, g, b = (channel >> OCCUPANCY_SHIFT for channel in unpack_rgbx(value))
+        cell = (b * bins + g) * bins + r
+        occupied[cell >> 3] |= 1 << (cell & 7)
+    return bytes(occupied)
+
+
+def occupancy_allows(occupancy, color, tolerance):
+    """Есть ли хоть одна занятая корзина в окрестности ±tolerance вокруг цвета."""
+    bins = 256 >> OCCUPANCY_SHIFT
+    ranges = [
+        range(max(0, c - tolerance) >> OCCUPANCY_SHIFT, (min(255, c + tolerance) >> OCCUPANCY_SHIFT) + 1)
+        for c in color
+    ]
+    for b in ranges[2]:
+        for g in ranges[1]:
+            for r in ranges[0]:
+                cell = (b * bins + g) * bins + r
+                if occupancy[cell >> 3] & (1 << (cell & 7)):
+                    return True
+    return False
+
+
+def _srgb_to_lab(r, g, b):
+    """sRGB (0..255, массивы NumPy) -> CIE Lab при D65."""
+    def linear(c):
+        c = c / 255.0
+        return np.where(c <= 0.04045, c / 12.92, ((c + 0.055) / 1.055) ** 2.4)
+
+    rl, gl, bl = linear(r), linear(g), linear(b)
+    x = (0.4124564 * rl + 0.3575761 * gl + 0.1804375 * bl) / 0.95047
+    y = 0.2126729 * rl + 0.7151522 * gl + 0.0721750 * bl
+    z = (0.0193339 * rl + 0.1191920 * gl + 0.9503041 * bl) / 1.08883
+
+    def f(t):
+        return np.where(t > 216 / 24389, np.cbrt(t), (24389 / 27 * t + 16) / 116)
+
+    fx, fy, fz = f(x), f(y), f(z)
+    return 116 * fy - 16, 500 * (fx - fy), 200 * (fy - fz)
+
+
+def ciede2000(lab1, lab2):
+    """ΔE00 между цветом lab1 и массивами lab2 (формула Sharma и др., 2005)."""
+    l1, a1, b1 = lab1
+    l2, a2, b2 = lab2
+    c_mean = (np.hypot(a1, b1) + np.hypot(a2, b2)) / 2
+    g = 0.5 * (1 - np.sqrt(c_mean ** 7 / (c_mean ** 7 + 25.0 ** 7)))
+    a1p, a2p = (1 + g) * a1, (1 + g) * a2
+    c1p, c2p = np.hypot(a1p, b1), np.hypot(a2p, b2)
+    h1p = np.degrees(np.arctan2(b1, a1p)) % 360
+    h2p = np.degrees(np.arctan2(b2, a2p)) % 360
+
+    dl = l2 - l1
+    dc = c2p - c1p
+    dh = h2p - h1p
+    dh = np.where(c1p * c2p == 0, 0, np.where(dh > 180, dh - 360, np.where(dh < -180, dh + 360, dh)))
+    dh_big = 2 * np.sqrt(c1p * c2p) * np.sin(np.radians(dh / 2))
+
+    l_mean = (l1 + l2) / 2
+    cp_mean = (c1p + c2p) / 2
+    h_sum = h1p + h2p
+    hp_mean = np.where(
+        c1p * c2p == 0, h_sum,
+        np.where(np.abs(h1p - h2p) <= 180, h_sum / 2, np.where(h_sum < 360, (h_sum + 360) / 2, (h_sum - 360) / 2)),
+    )
+    t = (1 - 0.17 * np.cos(np.radians(hp_mean - 30)) + 0.24 * np.cos(np.radians(2 * hp_mean))
+         + 0.32 * np.cos(np.radians(3 * hp_mean + 6)) - 0.20 * np.cos(np.radians(4 * hp_mean - 63)))
+    d_theta = 30 * np.exp(-(((hp_mean - 275) / 25) ** 2))
+    r_c = 2 * np.sqrt(cp_mean ** 7 / (cp_mean ** 7 + 25.0 ** 7))
+    s_l = 1 + 0.015 * (l_mean - 50) ** 2 / np.sqrt(20 + (l_mean - 50) ** 2)
+    s_c = 1 + 0.045 * cp_mean
+    s_h = 1 + 0.015 * cp_mean * t
+    r_t = -np.sin(np.radians(2 * d_theta)) * r_c
+    return np.sqrt((dl / s_l) ** 2 + (dc / s_c) ** 2 + (dh_big / s_h) ** 2 + r_t * (dc / s_c) * (dh_big / s_h))
+
+
+def _has_near_color(packed_colors, color, tolerance, metric):
+    """Ищет в отсортированном наборе цветов хотя бы один близкий к color.
+
+    Набор отсортирован по B (старший байт), поэтому для RGB-допуска
+    достаточно бинарным поиском вырезать полосу B±tolerance.
+    """
+    r0, g0, b0 = color
+    if metric == "ciede2000":
+        values = np.frombuffer(packed_colors, dtype='<u4').astype(np.int64)
+        lab = _srgb_to_lab(values & 0xFF, (values >> 8) & 0xFF, (values >> 16) & 0xFF)
+        target = _srgb_to_lab(np.array([r0]), np.array([g0]), np.array([b0]))
+        return bool((ciede2000(target, lab) <= tolerance).any())
+
+    view = memoryview(packed_colors).cast('I')
+    lo = bisect.bisect_left(view, pack_rgbx((0, 0, max(0, b0 - tolerance))))
+    hi = bisect.bisect_right(view, pack_rgbx((255, 255, min(255, b0 + tolerance))))
+    if NUMPY_AVAILABLE:
+        band = np.frombuffer(packed_colors, dtype='<u4')[lo:hi].astype(np.int32)
+        return bool(((np.abs((band & 0xFF) - r0) <= tolerance)
+                     & (np.abs(((band >> 8) & 0xFF) - g0) <= tolerance)).any())
+    for value in view[lo:hi]:
+        r, g, _b = unpack_rgbx(value)
+        if abs(r - r0) <= tolerance and abs(g - g0) <= tolerance:
+            return True
+    return False
+
+
+def colors_match(packed_colors, colors, tolerance=0, metric="rgb", occupancy=None):
+    """Все ли цвета есть в наборе — точно или с допуском.
+
+    packed_colors — байты из distinct_colors либо функция, возвращающая
+    их по требованию (так сжатый набор из индекса распаковывается, только
+    если карта занятости не отсекла изображение сразу).
+    """
+    if occupancy is not None and metric == "rgb":
+        for color in colors:
+            if not occupancy_allows(occupancy, color, tolerance):
+                return False
+    if callable(packed_colors):
+        packed_colors = packed_colors()
+    if tolerance <= 0:
+        return colors_contain(packed_colors, colors)
+    return all(_has_near_color(packed_colors, color, tolerance, metric) for color in colors)
+
+
+class ColorIndex:
+    """Постоянный индекс цветов папки: имя файла -> размеры и множество цветов.
+
+    Множество хранится как сжатый отсортированный массив uint32. Запись
+    действительна, пока у файла не изменились размер и mtime, поэтому
+    повторный поиск другого цвета не декодирует ни одного изображения.
+
+    Индекс открыт в режиме WAL и фиксируется пачками, поэтому несколько
+    поисков по одной папке не блокируют друг друга. При ошибке SQLite
+    индекс отключается, а файлы декодируются как без него.
+    """
+
+    def __init__(self, folder):
+        self.folder = folder
+        self.hits = 0
+        self.misses = 0
+        self._uncommitted = 0
+        self._conn = sqlite3.connect(os.path.join(folder, COLOR_INDEX_NAME), timeout=COLOR_INDEX_BUSY_TIMEOUT)
+        self._conn.execute("PRAGMA journal_mode=WAL")
+        if self._conn.execute("PRAGMA user_version").fetchone()[0] != COLOR_INDEX_VERSION:
+            self._conn.execute("DROP TABLE IF EXISTS images")
+            self._conn.execute(f"PRAGMA user_version = {COLOR_INDEX_VERSION}")
+        self._conn.execute(
+            "CREATE TABLE IF NOT EXISTS images ("
+            " name TEXT PRIMARY KEY, size INTEGER NOT NULL, mtime_ns INTEGER NOT NULL,"
+            " width INTEGER NOT NULL, height INTEGER NOT NULL,"
+            " occupancy BLOB NOT NULL, colors BLOB NOT NULL)"
+        )
+
+    def _disable(self, error):
+        _log(f"Индекс цветов недоступен, дальше ищем без него: {error}")
+        try:
+            self._conn.close()
+        except sqlite3.Error:
+            pass
+        self._conn = None
+
+    def lookup(self, name, st):
+        """(ширина, высота, карта занятости, функция распаковки цветов) или None."""
+        row = None
+        if self._conn is not None:
+            try:
+                row = self._conn.execute(
+                    "SELECT size, mtime_ns, width, height, occupancy, colors FROM images WHERE name = ?", (name,)
+                ).fetchone()
+            except sqlite3.Error as e:
+                self._disable(e)
+        if row and row[0] == st.st_size and row[1] == st.st_mtime_ns:
+            self.hits += 1
+            compressed = row[5]
+            return row[2], row[3], row[4], lambda: zlib.decompress(compressed)
+        self.misses += 1
+        return None
+
+    def store(self, name, st, width, height, packed_colors):
+        if self._conn is None:
+            return
+        try:
+            self._conn.execute(
+                "INSERT OR REPLACE INTO images VALUES (?, ?, ?, ?, ?, ?, ?)",
+                (name, st.st_size, st.st_mtime_ns, width, height,
+                 occupancy_map(packed_colors), zlib.compress(packed_colors, 1)),
+            )
+            self._uncommitted += 1
+            if self._uncommitted >= COLOR_INDEX_COMMIT_EVERY:
+                self._conn.commit()
+                self._uncommitted = 0
+        except sqlite3.Error as e:
+            self._disable(e)
+
+    def prune(self, names):
+        if self._conn is None:
+            return
+        alive = set(names)
+        try:
+            stale = [(name,) for (name,) in self._conn.execute("SELECT name FROM images") if name not in alive]
+            self._conn.executemany("DELETE FROM images WHERE name = ?", stale)
+        except sqlite3.Error as e:
+            self._disable(e)
+
+    def close(self):
+        if self._conn is None:
+            return
+        try:
+            self._conn.commit()
+        except sqlite3.Error as e:
+            self._disable(e)
+            return
+        self._conn.close()
+        self._conn = None
+
+
+def open_color_index(folder):
+    if not USE_COLOR_INDEX:
+        return None
+    try:
+        return ColorIndex(folder)
+    except sqlite3.Error as e:
+        _log(f"Индекс цветов недоступен, ищем без него: {e}")
+        return None
+
+
+def iter_candidates(folder):
+    """Лениво отдаёт ScanEntry подходящих изображений папки (рекурсивно, со stat)."""
+    return scan_files(folder, SUPPORTED_GLOBS, EXCLUDE_GLOBS, recursive=SEARCH_RECURSIVE)
+
+
+def _scan_file(file_path, colors, want_entry, tolerance=0, metric="rgb"):
+    """Декодирует один файл в воркере: (ширина, высота, цвета или None, совпал ли, ошибка)."""
+    try:
+        with Image.open(file_path) as img:
+            img_rgb = img.convert('RGB')
+            if want_entry or tolerance > 0:
+                packed_colors = distinct_colors(img_rgb)
+                matched = colors_match(packed_colors, colors, tolerance, metric)
+                return img.width, img.height, packed_colors if want_entry else None, matched, None
+            return img.width, img.height, None, image_has_colors(img_rgb, colors), None
+    except Exception as e:
+        return 0, 0, None, False, str(e)
+
+
+def iter_search(folder, entries, colors, workers=1, cancel_event=None, tolerance=0, metric="rgb"):
+    """Проверяет файлы и отдаёт (путь, результат или None) по мере готовности.
+
+    tolerance > 0 включает приближённый поиск: допуск по каждому каналу
+    для metric="rgb" или порог ΔE00 для metric="ciede2000" (нужен NumPy).
+    Сравниваются только различные цвета изображения, а не все пиксели.
+
+    entries — поток ScanEntry (обычно iter_candidates), он читается лениво.
+    Результат — кортеж (путь, пиксели, (w, h)). Файлы из индекса цветов
+    отвечаются сразу, остальные декодируются в пуле из workers процессов,
+    не дожидаясь конца обхода папки. Если cancel_event установлен, поиск
+    прекращается как можно раньше.
+    """
+    index = open_color_index(folder)
+    job = partial(_scan_file, colors=colors, want_entry=index is not None, tolerance=tolerance, metric=metric)
+    pool = ProcessPoolExecutor(max_workers=workers) if workers > 1 else None
+    inflight = deque()
+    seen = []
+
+    def finish(entry, outcome):
+        width, height, packed_colors, matched, error = outcome
+        if error is not None:
+            _log(f"Не удалось обработать файл {entry.relpath}: {error}")
+            return entry.path, None
+        if index is not None:
+            index.store(entry.relpath, entry.stat, width, height, packed_colors)
+        return entry.path, (entry.path, width * height, (width, height)) if matched else None
+
+    def cancelled():
+        return cancel_event is not None and cancel_event.is_set()
+
+    try:
+        for entry in entries:
+            if cancelled():
+                return
+            seen.append(entry.relpath)
+            cached = index.lookup(entry.relpath, entry.stat) if index is not None else None
+            if cached is not None:
+                width, height, occupancy, load_colors = cached
+                matched = colors_match(load_colors, colors, tolerance, metric, occupancy)
+                yield entry.path, (entry.path, width * height, (width, height)) if matched else None
+            elif pool is None:
+                yield finish(entry, job(entry.path))
+            else:
+                inflight.append((entry, pool.submit(job, entry.path)))
+
+            while inflight and (inflight[0][1].done() or len(inflight) > SEARCH_MAX_INFLIGHT):
+                queued, future = inflight.popleft()
+                yield finish(queued, future.result())
+
+        while inflight:
+            if cancelled():
+                return
+            queued, future = inflight.popleft()
+            yield finish(queued, future.result())
+
+        if index is not None:
+            index.prune(seen)
+    finally:
+        if pool is not None:
+            pool.shutdown(wait=False, cancel_futures=True)
+        if index is not None:
+            index.close()
+            _log(f"Индекс цветов: из индекса {index.hits}, декодировано {index.misses}")
+
+
+def search_folder(folder, colors, workers=1, tolerance=0, metric="rgb", cancel_event=None):
+    """Генератор совпадений (путь, пиксели, (w, h)) по папке в порядке готовности."""
+    for _path, match in iter_search(folder, iter_candidates(folder), colors, workers, cancel_event,
+                                    tolerance, metric):
+        if match is not None:
+            yield match
+
+
+def _result_json(match):
+    path, total_pixels, (width, height) = match
+    return json.dumps({"path": path, "pixels": total_pixels, "width": width, "height": height},
+                      ensure_ascii=False)
+
+
+def main(argv=None):
+    parser = argparse.ArgumentParser(description="Поиск изображений, содержащих заданные цвета.")
+    parser.add_argument("folder", help="папка для поиска")
+    parser.add_argument("colors", nargs="+", help="цвета в hex, например FF0000")
+    parser.add_argument("--sort", choices=SORT_ORDERS, default="none",
+                        help="порядок вывода; none — потоково, по мере нахождения")
+    parser.add_argument("--workers", type=int, default=SEARCH_WORKERS, help="процессов для декодирования")
+    parser.add_argument("--tolerance", type=float, default=0, help="допуск (по каналам или ΔE00)")
+    parser.add_argument("--metric", choices=tuple(COLOR_METRICS), default="rgb")
+    parser.add_argument("--no-index", action="store_true", help="не читать и не писать индекс цветов")
+    parser.add_argument("--no-recursive", action="store_true", help="не заходить во вложенные папки")
+    args = parser.parse_args(argv)
+
+    global USE_COLOR_INDEX, SEARCH_RECURSIVE
+    USE_COLOR_INDEX = USE_COLOR_INDEX and not args.no_index
+    SEARCH_RECURSIVE = SEARCH_RECURSIVE and not args.no_recursive
+
+    try:
+        colors = [hex_to_rgb(code) for code in args.colors]
+    except ValueError as e:
+        parser.error(str(e))
+    if args.metric == "ciede2000" and not NUMPY_AVAILABLE:
+        parser.error("метрика ciede2000 требует NumPy")
+    tolerance = int(args.tolerance) if args.metric == "rgb" else args.tolerance
+
+    matches = search_folder(args.folder, colors, args.workers, tolerance, args.metric)
+    if args.sort != "none":
+        matches = sort_results(list(matches), args.sort)
+    try:
+        for match in matches:
+            sys.stdout.write(_result_json(match) + "\n")
+            sys.stdout.flush()
+    except BrokenPipeError:
+        # Читатель (например, head) закрыл поток — молча выходим
+        os.dup2(os.open(os.devnull, os.O_WRONLY), sys.stdout.fileno())
+        sys.exit(1)
+
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,89 @@
+import os
+import sys
+import fnmatch
+from typing import Iterator, NamedTuple, Sequence, Set, Tuple
+
+
+def _warn(message: str) -> None:
+    # stdout не трогаем: там может быть вывод вызывающего (JSON-строки color_search)
+    print(message, file=sys.stderr)
+
+
+class ScanEntry(NamedTuple):
+    path: str
+    relpath: str
+    stat: os.stat_result
+
+
+def _matches(relpath: str, name: str, patterns: Sequence[str]) -> bool:
+    """Шаблон со «/» сравнивается с относительным путём, без него — с именем.
+
+    Сравнение без учёта регистра, как прежний lower().endswith(...).
+    """
+
+    rel = relpath.replace(os.sep, "/").lower()
+    low_name = name.lower()
+    for pattern in patterns:
+        pattern = pattern.lower()
+        if fnmatch.fnmatchcase(rel if "/" in pattern else low_name, pattern):
+            return True
+    return False
+
+
+def scan_files(
+    root: str,
+    include: Sequence[str] = ("*",),
+    exclude: Sequence[str] = (),
+    recursive: bool = True,
+    follow_symlinks: bool = True,
+) -> Iterator[ScanEntry]:
+    """Лениво обходит папку через os.scandir и отдаёт файлы вместе с их stat.
+
+    Записи каждой папки идут по имени, поэтому порядок обхода стабилен.
+    exclude отсекает и файлы, и целые подпапки. Каталоги, уже пройденные
+    по (st_dev, st_ino), повторно не посещаются — петли из симлинков
+    не зацикливают обход.
+    """
+
+    visited: Set[Tuple[int, int]] = set()
+
+    def walk(directory: str, rel_dir: str) -> Iterator[ScanEntry]:
+        try:
+            dir_stat = os.stat(directory)
+        except OSError as e:
+            _warn(f"⚠️ Не удалось открыть {directory}: {e}")
+            return
+        key = (dir_stat.st_dev, dir_stat.st_ino)
+        if key in visited:
+            return
+        visited.add(key)
+
+        try:
+            with os.scandir(directory) as it:
+                entries = sorted(it, key=lambda e: e.name)
+        except OSError as e:
+            _warn(f"⚠️ Не удалось открыть {directory}: {e}")
+            return
+
+        for entry in entries:
+            relpath = os.path.join(rel_dir, entry.name) if rel_dir else entry.name
+            if exclude and _matches(relpath, entry.name, exclude):
+                continue
+            try:
+                is_dir = entry.is_dir(follow_symlinks=follow_symlinks)
+            except OSError:
+                is_dir = False
+            if is_dir:
+                if recursive:
+                    yield from walk(entry.path, relpath)
+                continue
+            if not _matches(relpath, entry.name, include):
+                continue
+            try:
+                st = entry.stat(follow_symlinks=follow_symlinks)
+            except OSError as e:
+                _warn(f"⚠️ Не удалось прочитать {relpath}: {e}")
+                continue
+            yield ScanEntry(entry.path, relpath, st)
+
+    yield from walk(root, "")
@@ -1,18 +1,56 @@
-from typing import List, Tuple
+import os
+import json
+from typing import Dict, List, NamedTuple, Optional, Tuple
 from PIL import Image
 
+from atlas_packer import Placement, pack_rects
+
 from from_json_to_frame import (
     JSON_PATH,
     SPRITES_DIR,
+    OUTPUT_DIR,
     load_json,
     index_sprites,
-    build_frame,
+    resolve_sprites,
+    sprite_requirements,
+    iter_rendered_frames,
     trim_to_content,
+    frame_digest,
+    SpriteCache,
+    format_cache_stats,
+    PROFILE_PATH,
+    PROFILE_FORMAT,
+    CPROFILE_PATH,
+    SPRITE_STORE_PATH,
+    LAZY_SPRITE_RESOLVE,
 )
+from sprite_store import open_sprite_store
+from profiling import count, log, profiled_run, stage
 
 SPRITESHEET_PATH = "capture_0001_spritesheet.png"
+SPRITESHEET_META_PATH = "capture_0001_spritesheet.json"
 CELL_PADDING = 10
 
+# "atlas" — плотная упаковка MaxRects по страницам, "row" — прежняя полоса ячеек
+SPRITESHEET_LAYOUT = "atlas"
+ATLAS_MAX_SIZE = (4096, 4096)
+ATLAS_PADDING = 2
+ATLAS_ALLOW_ROTATION = False
+# На скольких последних страницах искать место (остальные считаются закрытыми)
+ATLAS_OPEN_PAGES = 4
+
+# Одинаковые после обрезки кадры занимают одну ячейку, остальные — её алиасы
+DEDUP_FRAMES = True
+
+
+class TrimmedFrame(NamedTuple):
+    key: str
+    image: Image.Image
+    bbox: Tuple[int, int, int, int]
+    source_size: Tuple[int, int]
+    duration_ms: int
+    alias_of: Optional[str] = None
+
 
 def _center_offsets(cell_size: Tuple[int, int], image: Image.Image) -> Tuple[int, int]:
     cell_w, cell_h = cell_size
@@ -21,44 +59,156 @@ def _center_offsets(cell_size: Tuple[int, int], image: Image.Image) -> Tuple[int
     return offset_x, offset_y
 
 
-def main() -> None:
-    data = load_json(JSON_PATH)
-    frame_keys = data["meta"]["frame_keys"]
-    frames = data["frames"]
-
-    hash_to_path = index_sprites(SPRITES_DIR)
-
-    trimmed_frames: List[Tuple[str, Image.Image]] = []
+def _page_path(page: int) -> str:
+    if page == 0:
+        return SPRITESHEET_PATH
+    root, ext = os.path.splitext(SPRITESHEET_PATH)
+    return f"{root}_{page}{ext}"
 
-    for key in frame_keys:
-        print(f"🧩 Собираем {key} …")
-        frame_image = build_frame(key, frames, hash_to_path)
-        trimmed, _bbox = trim_to_content(frame_image)
-        trimmed_frames.append((key, trimmed))
 
-    if not trimmed_frames:
-        print("❌ Нет кадров для экспорта.")
-        return
+def layout_row(trimmed_frames: List[TrimmedFrame]) -> Tuple[List[Placement], List[Tuple[int, int]]]:
+    """Прежняя раскладка: одна строка ячеек по размеру самого большого кадра."""
 
-    max_width = max(img.width for _, img in trimmed_frames)
-    max_height = max(img.height for _, img in trimmed_frames)
+    max_width = max(frame.image.width for frame in trimmed_frames)
+    max_height = max(frame.image.height for frame in trimmed_frames)
 
     cell_width = max_width + CELL_PADDING * 2
     cell_height = max_height + CELL_PADDING * 2
 
-    sheet_width = cell_width * len(trimmed_frames)
-    sheet_height = cell_height
+    placements: List[Placement] = []
+    for idx, frame in enumerate(trimmed_frames):
+        log(f"📍 Размещаем {frame.key} в колонке {idx}")
+        offset_x, offset_y = _center_offsets((cell_width, cell_height), frame.image)
+        placements.append(
+            Placement(
+                frame.key, 0, idx * cell_width + offset_x, offset_y,
+                frame.image.width, frame.image.height, False,
+            )
+        )
+    return placements, [(cell_width * len(trimmed_frames), cell_height)]
+
+
+def layout_atlas(trimmed_frames: List[TrimmedFrame]) -> Tuple[List[Placement], List[Tuple[int, int]]]:
+    sizes = [(frame.key, frame.image.width, frame.image.height) for frame in trimmed_frames]
+    placements, pages = pack_rects(
+        sizes, ATLAS_MAX_SIZE, ATLAS_PADDING, ATLAS_ALLOW_ROTATION, ATLAS_OPEN_PAGES
+    )
+    used = sum(frame.image.width * frame.image.height for frame in trimmed_frames)
+    total = sum(w * h for w, h in pages)
+    log(f"📐 Атлас: страниц {len(pages)}, заполнение {used / total:.0%}")
+    return placements, pages
+
+
+def write_sheet_meta(
+    path: str,
+    trimmed_frames: List[TrimmedFrame],
+    placements: List[Placement],
+    pages: List[Tuple[int, int]],
+) -> None:
+    """Сайдкар в духе TexturePacker JSON: прямоугольник в атласе и смещения обрезки."""
+
+    by_key: Dict[str, Placement] = {place.key: place for place in placements}
+    aliases = sum(1 for frame in trimmed_frames if frame.alias_of is not None)
+    meta = {
+        "meta": {
+            "layout": SPRITESHEET_LAYOUT,
+            "pages": [
+                {"image": os.path.basename(_page_path(i)), "size": {"w": w, "h": h}}
+                for i, (w, h) in enumerate(pages)
+            ],
+            "unique_frames": len(trimmed_frames) - aliases,
+            "aliases": aliases,
+        },
+        "frames": {},
+    }
+    for frame in trimmed_frames:
+        place = by_key[frame.alias_of or frame.key]
+        x0, y0, x1, y1 = frame.bbox
+        entry = meta["frames"][frame.key] = {
+            "page": place.page,
+            "frame": {"x": place.x, "y": place.y, "w": place.width, "h": place.height},
+            "rotated": place.rotated,
+            "trimmed": (x0, y0, x1, y1) != (0, 0) + frame.source_size,
+            "spriteSourceSize": {"x": x0, "y": y0, "w": x1 - x0, "h": y1 - y0},
+            "sourceSize": {"w": frame.source_size[0], "h": frame.source_size[1]},
+            "duration_ms": frame.duration_ms,
+        }
+        if frame.alias_of is not None:
+            entry["alias_of"] = frame.alias_of
+    with open(path, "w", encoding="utf-8") as fh:
+        json.dump(meta, fh, ensure_ascii=False, indent=1)
+        count("bytes_written", fh.tell())
+
+
+def main() -> None:
+    with profiled_run(PROFILE_PATH, PROFILE_FORMAT, CPROFILE_PATH):
+        _run()
+
+
+def _run() -> None:
+    os.makedirs(OUTPUT_DIR, exist_ok=True)
 
-    spritesheet = Image.new("RGBA", (sheet_width, sheet_height), (0, 0, 0, 0))
+    data = load_json(JSON_PATH)
+    frame_keys = data["meta"]["frame_keys"]
+    frames = data["frames"]
 
-    for idx, (key, img) in enumerate(trimmed_frames):
-        print(f"📍 Размещаем {key} в колонке {idx}")
-        cell_origin_x = idx * cell_width
-        offset_x, offset_y = _center_offsets((cell_width, cell_height), img)
-        spritesheet.paste(img, (cell_origin_x + offset_x, offset_y), img)
+    if LAZY_SPRITE_RESOLVE:
+        hash_to_path = resolve_sprites(SPRITES_DIR, frames)
+    else:
+        hash_to_path = index_sprites(SPRITES_DIR, needed=sprite_requirements(frames))
+    store = open_sprite_store(SPRITE_STORE_PATH, hash_to_path) if SPRITE_STORE_PATH else None
+    sprite_cache = SpriteCache(store=store)
+
+    trimmed_frames: List[TrimmedFrame] = []
+    seen: Dict[str, TrimmedFrame] = {}
+
+    for key, frame_image in iter_rendered_frames(
+        frame_keys, frames, hash_to_path, OUTPUT_DIR, sprite_cache
+    ):
+        trimmed, bbox = trim_to_content(frame_image)
+        frame = TrimmedFrame(key, trimmed, bbox, frame_image.size, frames[key].get("duration_ms", 40))
+        if DEDUP_FRAMES:
+            original = seen.setdefault(frame_digest(trimmed), frame)
+            if original is not frame:
+                # Пиксели берутся из ячейки оригинала, свою копию не держим
+                frame = frame._replace(image=original.image, alias_of=original.key)
+        trimmed_frames.append(frame)
+
+    if sprite_cache.hits or sprite_cache.misses:
+        log(format_cache_stats(sprite_cache))
+
+    if not trimmed_frames:
+        log("❌ Нет кадров для экспорта.")
+        return
 
-    spritesheet.save(SPRITESHEET_PATH)
-    print(f"✅ Spritesheet сохранён: {SPRITESHEET_PATH}")
+    unique_frames = [frame for frame in trimmed_frames if frame.alias_of is None]
+    if len(unique_frames) < len(trimmed_frames):
+        log(f"♻️ Повторов кадров: {len(trimmed_frames) - len(unique_frames)}")
+
+    with stage("layout"):
+        if SPRITESHEET_LAYOUT == "row":
+            placements, pages = layout_row(unique_frames)
+        else:
+            placements, pages = layout_atlas(unique_frames)
+
+    # Ячейки атласа не пересекаются, поэтому пиксели копируются как есть:
+    # смешивание по маске портило бы полупрозрачные края относительно разметки.
+    # Полоса сохраняет прежнюю вставку с маской, чтобы совпадать со старым выводом.
+    use_mask = SPRITESHEET_LAYOUT == "row"
+    with stage("sheet_compose"):
+        sheets = [Image.new("RGBA", size, (0, 0, 0, 0)) for size in pages]
+        for frame, place in zip(unique_frames, placements):
+            img = frame.image.transpose(Image.ROTATE_270) if place.rotated else frame.image
+            sheets[place.page].paste(img, (place.x, place.y), img if use_mask else None)
+
+    for page, sheet in enumerate(sheets):
+        with stage("png_encode"):
+            sheet.save(_page_path(page))
+        count("bytes_written", os.path.getsize(_page_path(page)))
+        log(f"✅ Spritesheet сохранён: {_page_path(page)}")
+
+    write_sheet_meta(SPRITESHEET_META_PATH, trimmed_frames, placements, pages)
+    log(f"🗒️ Разметка сохранена: {SPRITESHEET_META_PATH}")
 
 
 if __name__ == "__main__":
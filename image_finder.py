@@ -5,7 +5,22 @@ from PIL import Image, ImageTk
 import os
 import re
 import sys
+import hashlib
+import queue
 import subprocess
+import threading
+from collections import OrderedDict
+from concurrent.futures import ThreadPoolExecutor
+
+from color_search import (
+    COLOR_METRICS,
+    NUMPY_AVAILABLE,
+    SEARCH_WORKERS,
+    iter_candidates,
+    iter_search,
+    natural_sort_key,
+    sort_results,
+)
 
 # --- Новые импорты для расширенного взаимодействия с Windows ---
 # Если этих библиотек нет, будет использован старый метод
@@ -23,6 +38,46 @@ THUMBNAIL_SIZE = (150, 150)
 BG_COLOR = "#f0f0f0"
 FONT_TUPLE = ("Helvetica", 10)
 DIM_FONT_TUPLE = ("Helvetica", 8)
+SEARCH_PROGRESS_EVERY = 8  # как часто (в файлах) сообщать прогресс без новых совпадений
+SEARCH_POLL_MS = 100  # как часто интерфейс забирает результаты из очереди
+CELL_SIZE = (THUMBNAIL_SIZE[0] + 20, THUMBNAIL_SIZE[1] + 70)  # ячейка сетки результатов
+THUMBNAIL_CACHE_DIR = os.path.join(os.path.expanduser("~"), ".cache", "image_finder", "thumbnails")
+THUMBNAIL_WORKERS = 2  # потоков для фоновой генерации миниатюр
+THUMBNAIL_MEMORY_ITEMS = 512  # сколько готовых PhotoImage держать в памяти
+
+
+class ThumbnailCache:
+    """Дисковый кэш миниатюр: PNG с ключом из пути, mtime, размера файла и THUMBNAIL_SIZE."""
+
+    def __init__(self, cache_dir=THUMBNAIL_CACHE_DIR, size=THUMBNAIL_SIZE):
+        self.cache_dir = cache_dir
+        self.size = size
+
+    def _cache_path(self, path, st):
+        key = f"{os.path.abspath(path)}|{st.st_mtime_ns}|{st.st_size}|{self.size[0]}x{self.size[1]}"
+        return os.path.join(self.cache_dir, hashlib.sha1(key.encode("utf-8")).hexdigest() + ".png")
+
+    def load(self, path):
+        """Возвращает миниатюру (PIL.Image), при необходимости создавая и сохраняя её."""
+        cache_path = self._cache_path(path, os.stat(path))
+        try:
+            with Image.open(cache_path) as cached:
+                cached.load()
+                return cached
+        except (OSError, ValueError):
+            pass
+
+        with Image.open(path) as img:
+            img.thumbnail(self.size, Image.Resampling.LANCZOS)
+            if img.mode not in ("RGB", "RGBA", "L", "LA", "P"):
+                img = img.convert("RGBA")
+            img.load()
+        try:
+            os.makedirs(self.cache_dir, exist_ok=True)
+            img.save(cache_path)
+        except OSError as e:
+            print(f"Не удалось сохранить миниатюру {path}: {e}")
+        return img
 
 
 class ProductionImageFinderApp:
@@ -33,8 +88,19 @@ class ProductionImageFinderApp:
         self.root.configure(bg=BG_COLOR)
 
         self.folder_path = ""
-        self.photo_references = []
+        self.thumbnail_cache = ThumbnailCache()
+        self._thumb_photos = OrderedDict()  # путь -> PhotoImage, LRU
+        self._thumb_pending = set()
+        self._thumb_queue = queue.Queue()
+        self._thumb_pool = ThreadPoolExecutor(max_workers=THUMBNAIL_WORKERS)
+        self._thumb_polling = False
+        self._thumb_placeholder = tk.PhotoImage(width=THUMBNAIL_SIZE[0], height=THUMBNAIL_SIZE[1])
+        self._cells = []  # переиспользуемые виджеты видимых ячеек
+        self._grid_cols = 1
         self.found_data = []
+        self._search_queue = None
+        self._cancel_event = None
+        self._search_progress = (0, 0)
         self._is_updating_color1 = False
         self._is_updating_color2 = False
 
@@ -91,16 +157,32 @@ class ProductionImageFinderApp:
         self.sort_combobox.set(sort_options[0])
         self.sort_combobox.bind("<<ComboboxSelected>>", self.on_sort_change)
 
+        tolerance_frame = tk.Frame(control_frame, bg=BG_COLOR)
+        tolerance_frame.grid(row=2, column=5, padx=(20, 5), pady=5, sticky="w")
+        tk.Label(tolerance_frame, text="Допуск:", bg=BG_COLOR, font=FONT_TUPLE).pack(side=tk.LEFT)
+        self.tolerance_var = tk.StringVar(value="0")
+        tk.Spinbox(tolerance_frame, from_=0, to=255, width=4, textvariable=self.tolerance_var,
+                   font=FONT_TUPLE).pack(side=tk.LEFT, padx=(5, 5))
+        # ΔE00 считается векторно, поэтому без NumPy доступен только допуск по каналам
+        metric_names = [name for key, name in COLOR_METRICS.items() if key == "rgb" or NUMPY_AVAILABLE]
+        self.metric_var = tk.StringVar(value=metric_names[0])
+        ttk.Combobox(tolerance_frame, textvariable=self.metric_var, values=metric_names, state="readonly",
+                     width=16).pack(side=tk.LEFT)
+
         self.search_btn = tk.Button(control_frame, text="Начать поиск", font=("Helvetica", 10, "bold"),
                                     command=self.start_search)
         self.search_btn.grid(row=0, column=6, rowspan=3, padx=20, pady=5, ipady=15, sticky="ns")
+        self.cancel_btn = tk.Button(control_frame, text="Отмена", command=self.cancel_search, state=tk.DISABLED)
+        self.cancel_btn.grid(row=0, column=7, rowspan=3, padx=(0, 5), pady=5, ipady=15, sticky="ns")
+        self.progress_var = tk.StringVar(value="")
+        tk.Label(control_frame, textvariable=self.progress_var, bg=BG_COLOR, font=FONT_TUPLE, anchor="w").grid(
+            row=3, column=0, columnspan=8, padx=5, sticky="w")
 
         self.canvas = tk.Canvas(results_outer_frame, bg=BG_COLOR)
         scrollbar = tk.Scrollbar(results_outer_frame, orient="vertical", command=self.canvas.yview)
-        self.results_frame = tk.Frame(self.canvas, bg=BG_COLOR)
-        self.results_frame.bind("<Configure>", lambda e: self.canvas.configure(scrollregion=self.canvas.bbox("all")))
-        self.canvas.create_window((0, 0), window=self.results_frame, anchor="nw")
-        self.canvas.configure(yscrollcommand=scrollbar.set)
+        self._scrollbar = scrollbar
+        # Каждый сдвиг вида пересчитывает, какие строки сетки нужно показать
+        self.canvas.configure(yscrollcommand=self._on_canvas_scroll)
         self.canvas.pack(side="left", fill="both", expand=True)
         scrollbar.pack(side="right", fill="y")
         self.canvas.bind_all("<MouseWheel>", self._on_mousewheel)
@@ -112,7 +194,7 @@ class ProductionImageFinderApp:
         return tuple(int(hex_code[i:i + 2], 16) for i in (0, 2, 4))
 
     def natural_sort_key(self, s):
-        return [int(text) if text.isdigit() else text.lower() for text in re.split(r'(\d+)', s)]
+        return natural_sort_key(s)
 
     def _on_mousewheel(self, event):
         self.canvas.yview_scroll(int(-1 * (event.delta / 120)), "units")
@@ -142,11 +224,11 @@ class ProductionImageFinderApp:
         if not self.found_data: return
         sort_option = self.sort_var.get()
         if "По размеру (сначала большие)" in sort_option:
-            self.found_data.sort(key=lambda item: item[1], reverse=True)
+            sort_results(self.found_data, "size-desc")
         elif "По размеру (сначала маленькие)" in sort_option:
-            self.found_data.sort(key=lambda item: item[1], reverse=False)
+            sort_results(self.found_data, "size-asc")
         else:
-            self.found_data.sort(key=lambda item: self.natural_sort_key(os.path.basename(item[0])))
+            sort_results(self.found_data, "name")
         self.redraw_results_grid()
 
     def start_search(self):
@@ -162,73 +244,232 @@ class ProductionImageFinderApp:
                                                          f"Неверный формат дополнительного цвета: '{hex_code2}'."); return
             rgb2 = self.hex_to_rgb(hex_code2)
 
+        try:
+            tolerance = float(self.tolerance_var.get().replace(',', '.'))
+        except ValueError:
+            tolerance = -1
+        if tolerance < 0: messagebox.showerror("Ошибка", "Допуск должен быть неотрицательным числом."); return
+        metric = next(key for key, name in COLOR_METRICS.items() if name == self.metric_var.get())
+        if metric == "rgb": tolerance = int(tolerance)
+
         self.clear_results()
-        status_label = tk.Label(self.results_frame, text="Идет поиск...", font=("Helvetica", 14), bg=BG_COLOR)
-        status_label.pack(pady=20)
-        self.root.update_idletasks()
-
-        self.found_data = self.find_images_with_colors(rgb1, rgb2)
-
-        status_label.destroy()
-        if not self.found_data: messagebox.showinfo("Результат", "Подходящие изображения не найдены."); return
-        self.on_sort_change()
-
-    def find_images_with_colors(self, color1_rgb, color2_rgb=None):
-        results_with_data = []
-        supported_formats = ('.png', '.jpg', '.jpeg', '.bmp', '.gif')
-        for filename in os.listdir(self.folder_path):
-            if filename.lower().endswith(supported_formats):
-                file_path = os.path.join(self.folder_path, filename)
-                try:
-                    with Image.open(file_path) as img:
-                        img_rgb = img.convert('RGB')
-                        image_colors = set(img_rgb.getdata())
-                        if color1_rgb in image_colors:
-                            if color2_rgb is None or color2_rgb in image_colors:
-                                width, height = img.size
-                                results_with_data.append((file_path, width * height, (width, height)))
-                except Exception as e:
-                    print(f"Не удалось обработать файл {filename}: {e}")
-        return results_with_data
+        self._search_queue = queue.Queue()
+        self._cancel_event = threading.Event()
+        self._search_progress = (0, 0)
+        self.progress_var.set("Идет поиск...")
+        self.search_btn.config(state=tk.DISABLED)
+        self.cancel_btn.config(state=tk.NORMAL)
+        threading.Thread(
+            target=self._search_thread,
+            args=(self.folder_path, [rgb1, rgb2], tolerance, metric, self._cancel_event, self._search_queue),
+            daemon=True,
+        ).start()
+        self.root.after(SEARCH_POLL_MS, self._poll_search_queue)
+
+    def cancel_search(self):
+        if self._cancel_event is not None:
+            self._cancel_event.set()
+            self.cancel_btn.config(state=tk.DISABLED)
+            self.progress_var.set("Отмена...")
+
+    @staticmethod
+    def _search_thread(folder, colors, tolerance, metric, cancel_event, results_queue):
+        """Фоновый поток: гоняет iter_search и кладёт в очередь пачки совпадений.
+
+        Сообщения — (вид, проверено, найдено файлов при обходе, данные).
+        """
+        colors = [color for color in colors if color is not None]
+        batch = []
+        done = 0
+        discovered = 0
+
+        def counted_candidates():
+            nonlocal discovered
+            for entry in iter_candidates(folder):
+                discovered += 1
+                yield entry
+
+        try:
+            for _path, match in iter_search(folder, counted_candidates(), colors, SEARCH_WORKERS, cancel_event,
+                                            tolerance, metric):
+                done += 1
+                if match is not None:
+                    batch.append(match)
+                if batch or done % SEARCH_PROGRESS_EVERY == 0:
+                    results_queue.put(("batch", done, discovered, batch))
+                    batch = []
+        except Exception as e:
+            results_queue.put(("error", done, discovered, str(e)))
+        results_queue.put(("batch", done, discovered, batch))
+        results_queue.put(("done", done, discovered, cancel_event.is_set()))
+
+    def _poll_search_queue(self):
+        """Забирает всё, что накопилось в очереди, и обновляет сетку одним перерисовыванием."""
+        new_items = []
+        finished = None
+        while True:
+            try:
+                kind, done, discovered, payload = self._search_queue.get_nowait()
+            except queue.Empty:
+                break
+            self._search_progress = (done, discovered)
+            if kind == "batch":
+                new_items.extend(payload)
+            elif kind == "error":
+                print(f"Ошибка поиска: {payload}")
+            elif kind == "done":
+                finished = payload
+
+        done, total = self._search_progress
+        if new_items:
+            self.found_data.extend(new_items)
+            self.on_sort_change()
+        if finished is None:
+            self.progress_var.set(f"Идет поиск... {done} из {total}, найдено {len(self.found_data)}")
+            self.root.after(SEARCH_POLL_MS, self._poll_search_queue)
+            return
+
+        self.search_btn.config(state=tk.NORMAL)
+        self.cancel_btn.config(state=tk.DISABLED)
+        status = "Поиск отменён" if finished else "Поиск завершён"
+        self.progress_var.set(f"{status}: проверено {done} из {total}, найдено {len(self.found_data)}")
+        self._search_queue = None
+        self._cancel_event = None
+        if not self.found_data and not finished:
+            messagebox.showinfo("Результат", "Подходящие изображения не найдены.")
+
+    def find_images_with_colors(self, *colors_rgb):
+        """Ищет изображения, содержащие все переданные цвета (None пропускаются)."""
+        colors = [color for color in colors_rgb if color is not None]
+        entries = iter_candidates(self.folder_path)
+        return [match for _path, match in iter_search(self.folder_path, entries, colors) if match is not None]
 
     def clear_results(self):
         self.found_data = []
-        self.photo_references = []
-        for widget in self.results_frame.winfo_children(): widget.destroy()
+        self.redraw_results_grid()
+
+    def _on_canvas_scroll(self, first, last):
+        self._scrollbar.set(first, last)
+        self._update_visible_cells()
 
     def redraw_results_grid(self, event=None):
-        for widget in self.results_frame.winfo_children(): widget.destroy()
-        self.photo_references = []
-        if not self.found_data: return
-        canvas_width = self.canvas.winfo_width()
-        max_cols = max(1, canvas_width // (THUMBNAIL_SIZE[0] + 20))
-        for i, (path, total_pixels, dims) in enumerate(self.found_data):
-            row, col = divmod(i, max_cols)
+        """Пересчитывает раскладку сетки; виджеты создаются только для видимых строк."""
+        cell_w, cell_h = CELL_SIZE
+        self._grid_cols = max(1, self.canvas.winfo_width() // cell_w)
+        rows = -(-len(self.found_data) // self._grid_cols)
+        self.canvas.configure(scrollregion=(0, 0, self._grid_cols * cell_w, rows * cell_h))
+        for cell in self._cells:
+            cell["index"] = None
+        if not self.found_data:
+            self.canvas.yview_moveto(0)
+        self._update_visible_cells()
+
+    def _make_cell(self):
+        cell_w, cell_h = CELL_SIZE
+        frame = tk.Frame(self.canvas, bg=BG_COLOR, width=cell_w - 10, height=cell_h - 10)
+        frame.pack_propagate(False)
+        img_label = tk.Label(frame, image=self._thumb_placeholder, bg=BG_COLOR)
+        img_label.pack()
+        text_label = tk.Label(frame, font=FONT_TUPLE, bg=BG_COLOR, wraplength=THUMBNAIL_SIZE[0])
+        text_label.pack()
+        dim_label = tk.Label(frame, font=DIM_FONT_TUPLE, bg=BG_COLOR, fg="gray")
+        dim_label.pack()
+        cell = {
+            "frame": frame,
+            "img": img_label,
+            "text": text_label,
+            "dim": dim_label,
+            "window": self.canvas.create_window((0, 0), window=frame, anchor="nw"),
+            "index": None,
+            "path": None,
+            "photo": None,
+        }
+        handler = lambda e, c=cell: c["path"] and self.show_context_menu(e, c["path"])
+        for widget in (frame, img_label, text_label, dim_label):
+            widget.bind("<Button-3>", handler)
+        self._cells.append(cell)
+        return cell
+
+    def _update_visible_cells(self):
+        cell_w, cell_h = CELL_SIZE
+        cols = self._grid_cols
+        top = int(self.canvas.canvasy(0))
+        bottom = top + self.canvas.winfo_height()
+        first = max(0, top // cell_h) * cols
+        last = min(len(self.found_data), (bottom // cell_h + 1) * cols)
+        needed = range(first, last)
+
+        # Ячейки, уже показывающие нужные индексы, не трогаем; остальные перепривязываем
+        free = [cell for cell in self._cells if cell["index"] not in needed]
+        shown = {cell["index"] for cell in self._cells if cell["index"] in needed}
+        for i in needed:
+            if i in shown:
+                continue
+            cell = free.pop() if free else self._make_cell()
+            self._bind_cell(cell, i)
+        for cell in free:
+            cell["index"] = None
+            cell["path"] = None
+            cell["photo"] = None
+            self.canvas.itemconfigure(cell["window"], state="hidden")
+
+    def _bind_cell(self, cell, i):
+        cell_w, cell_h = CELL_SIZE
+        path, _total_pixels, dims = self.found_data[i]
+        row, col = divmod(i, self._grid_cols)
+        cell["index"] = i
+        cell["path"] = path
+        cell["text"].config(text=os.path.basename(path))
+        cell["dim"].config(text=f"{dims[0]}x{dims[1]} px")
+        photo = self._thumb_photos.get(path)
+        if photo is not None:
+            self._thumb_photos.move_to_end(path)
+        else:
+            self._request_thumbnail(path)
+        # Ссылка в ячейке не даёт LRU удалить картинку, пока она на экране
+        cell["photo"] = photo
+        cell["img"].config(image=photo or self._thumb_placeholder)
+        self.canvas.coords(cell["window"], col * cell_w + 5, row * cell_h + 5)
+        self.canvas.itemconfigure(cell["window"], state="normal")
+
+    def _request_thumbnail(self, path):
+        if path in self._thumb_pending:
+            return
+        self._thumb_pending.add(path)
+        self._thumb_pool.submit(self._load_thumbnail, path)
+        if not self._thumb_polling:
+            self._thumb_polling = True
+            self.root.after(SEARCH_POLL_MS, self._poll_thumbnails)
+
+    def _load_thumbnail(self, path):
+        """Выполняется в пуле потоков: PhotoImage создаётся уже в главном потоке."""
+        try:
+            self._thumb_queue.put((path, self.thumbnail_cache.load(path)))
+        except Exception as e:
+            print(f"Ошибка при отображении файла {path}: {e}")
+            self._thumb_queue.put((path, None))
+
+    def _poll_thumbnails(self):
+        while True:
             try:
-                item_frame = tk.Frame(self.results_frame, bg=BG_COLOR)
-                item_frame.grid(row=row, column=col, padx=10, pady=10)
-                with Image.open(path) as img:
-                    img.thumbnail(THUMBNAIL_SIZE, Image.Resampling.LANCZOS)
-                    photo = ImageTk.PhotoImage(img)
-                self.photo_references.append(photo)
-                img_label = tk.Label(item_frame, image=photo, bg=BG_COLOR)
-                img_label.pack()
-                filename = os.path.basename(path)
-                text_label = tk.Label(item_frame, text=filename, font=FONT_TUPLE, bg=BG_COLOR,
-                                      wraplength=THUMBNAIL_SIZE[0])
-                text_label.pack()
-
-                dim_text = f"{dims[0]}x{dims[1]} px"
-                dim_label = tk.Label(item_frame, text=dim_text, font=DIM_FONT_TUPLE, bg=BG_COLOR, fg="gray")
-                dim_label.pack()
-
-                handler = lambda e, p=path: self.show_context_menu(e, p)
-                item_frame.bind("<Button-3>", handler)
-                img_label.bind("<Button-3>", handler)
-                text_label.bind("<Button-3>", handler)
-                dim_label.bind("<Button-3>", handler)
-            except Exception as e:
-                print(f"Ошибка при отображении файла {path}: {e}")
+                path, img = self._thumb_queue.get_nowait()
+            except queue.Empty:
+                break
+            self._thumb_pending.discard(path)
+            if img is None:
+                continue
+            photo = ImageTk.PhotoImage(img)
+            self._thumb_photos[path] = photo
+            while len(self._thumb_photos) > THUMBNAIL_MEMORY_ITEMS:
+                self._thumb_photos.popitem(last=False)
+            for cell in self._cells:
+                if cell["path"] == path:
+                    cell["photo"] = photo
+                    cell["img"].config(image=photo)
+        if self._thumb_pending:
+            self.root.after(SEARCH_POLL_MS, self._poll_thumbnails)
+        else:
+            self._thumb_polling = False
 
     def show_context_menu(self, event, path):
         context_menu = tk.Menu(self.root, tearoff=0)
@@ -0,0 +1,186 @@
+"""Замеры стадий конвейера: таймеры, счётчики и журнал вместо разрозненных print.
+
+По умолчанию выключено и почти ничего не стоит: stage() отдаёт пустой
+контекст, count() сразу возвращается. После enable() копятся отрезки
+времени по стадиям и счётчики; write() сохраняет их в JSON-сводку или в
+формате Chrome Trace (chrome://tracing, Perfetto). Воркеры пула копят
+своё и отдают drain(), родитель вливает это через merge().
+"""
+
+import os
+import sys
+import json
+import time
+import cProfile
+import threading
+import functools
+import contextlib
+from typing import Callable, Dict, Iterator, List, Optional, Tuple, TypeVar
+
+PROFILE_FORMATS = ("json", "chrome")
+
+_F = TypeVar("_F", bound=Callable)
+
+# (стадия, начало в мкс от эпохи профиля, длительность в мкс, pid, tid)
+_Span = Tuple[str, float, float, int, int]
+
+
+class Profiler:
+    """Отрезки времени по стадиям, счётчики и журнал сообщений одного процесса."""
+
+    def __init__(self) -> None:
+        self.enabled = False
+        self.quiet = False
+        self._origin = time.perf_counter()
+        self._spans: List[_Span] = []
+        self._counters: Dict[str, int] = {}
+        self._messages: List[Tuple[float, str]] = []
+
+    def enable(self, quiet: bool = False) -> None:
+        self.enabled = True
+        self.quiet = quiet
+        self.reset()
+
+    def reset(self) -> None:
+        self._origin = time.perf_counter()
+        self._spans = []
+        self._counters = {}
+        self._messages = []
+
+    def _now_us(self) -> float:
+        return (time.perf_counter() - self._origin) * 1e6
+
+    @contextlib.contextmanager
+    def _timed(self, name: str) -> Iterator[None]:
+        start = self._now_us()
+        try:
+            yield
+        finally:
+            self._spans.append(
+                (name, start, self._now_us() - start, os.getpid(), threading.get_ident())
+            )
+
+    def stage(self, name: str):
+        """Контекст-таймер стадии; вложенные стадии считаются отдельно."""
+
+        if not self.enabled:
+            return contextlib.nullcontext()
+        return self._timed(name)
+
+    def count(self, name: str, amount: int = 1) -> None:
+        if self.enabled:
+            self._counters[name] = self._counters.get(name, 0) + amount
+
+    def log(self, message: str) -> None:
+        if not self.quiet:
+            print(message)
+        if self.enabled:
+            self._messages.append((self._now_us(), message))
+
+    # --- обмен с воркерами ---
+    def drain(self) -> Optional[dict]:
+        """Забирает накопленное (в воркере) с абсолютными метками времени."""
+
+        if not self.enabled:
+            return None
+        origin_us = self._origin * 1e6
+        payload = {
+            "spans": [(n, s + origin_us, d, pid, tid) for n, s, d, pid, tid in self._spans],
+            "counters": self._counters,
+        }
+        self._spans = []
+        self._counters = {}
+        return payload
+
+    def merge(self, payload: Optional[dict]) -> None:
+        if not self.enabled or not payload:
+            return
+        origin_us = self._origin * 1e6
+        # perf_counter общий для процессов одной машины (CLOCK_MONOTONIC)
+        self._spans.extend((n, s - origin_us, d, pid, tid) for n, s, d, pid, tid in payload["spans"])
+        for name, amount in payload["counters"].items():
+            self._counters[name] = self._counters.get(name, 0) + amount
+
+    # --- вывод ---
+    def summary(self) -> dict:
+        stages: Dict[str, Dict[str, float]] = {}
+        for name, _start, duration, _pid, _tid in self._spans:
+            entry = stages.setdefault(name, {"calls": 0, "seconds": 0.0})
+            entry["calls"] += 1
+            entry["seconds"] += duration / 1e6
+        for entry in stages.values():
+            entry["seconds"] = round(entry["seconds"], 6)
+        return {
+            "wall_seconds": round(self._now_us() / 1e6, 6),
+            "stages": dict(sorted(stages.items(), key=lambda item: -item[1]["seconds"])),
+            "counters": dict(sorted(self._counters.items())),
+        }
+
+    def chrome_trace(self) -> dict:
+        events = [
+            {"name": name, "ph": "X", "ts": round(start, 3), "dur": round(duration, 3),
+             "pid": pid, "tid": tid, "cat": "stage"}
+            for name, start, duration, pid, tid in self._spans
+        ]
+        pid = os.getpid()
+        events.extend(
+            {"name": message, "ph": "i", "s": "p", "ts": round(ts, 3), "pid": pid, "tid": 0, "cat": "log"}
+            for ts, message in self._messages
+        )
+        events.append({"name": "counters", "ph": "C", "ts": round(self._now_us(), 3), "pid": pid,
+                       "args": dict(self._counters)})
+        return {"traceEvents": events, "displayTimeUnit": "ms"}
+
+    def write(self, path: str, fmt: str = "json") -> None:
+        if fmt not in PROFILE_FORMATS:
+            raise ValueError(f"Неизвестный формат профиля: {fmt}")
+        payload = self.chrome_trace() if fmt == "chrome" else self.summary()
+        with open(path, "w", encoding="utf-8") as fh:
+            json.dump(payload, fh, ensure_ascii=False, indent=None if fmt == "chrome" else 1)
+
+
+PROFILER = Profiler()
+stage = PROFILER.stage
+count = PROFILER.count
+log = PROFILER.log
+
+
+def timed(name: str) -> Callable[[_F], _F]:
+    """Декоратор: весь вызов функции — стадия name."""
+
+    def decorate(func: _F) -> _F:
+        @functools.wraps(func)
+        def wrapper(*args, **kwargs):
+            if not PROFILER.enabled:
+                return func(*args, **kwargs)
+            with PROFILER.stage(name):
+                return func(*args, **kwargs)
+
+        return wrapper  # type: ignore[return-value]
+
+    return decorate
+
+
+@contextlib.contextmanager
+def profiled_run(
+    profile_path: Optional[str],
+    profile_format: str = "json",
+    cprofile_path: Optional[str] = None,
+) -> Iterator[Profiler]:
+    """Включает замеры на время запуска и сохраняет их (и дамп cProfile) в конце."""
+
+    if profile_path:
+        PROFILER.enable()
+    profiler = cProfile.Profile() if cprofile_path else None
+    if profiler is not None:
+        profiler.enable()
+    try:
+        yield PROFILER
+    finally:
+        if profiler is not None:
+            profiler.disable()
+            profiler.dump_stats(cprofile_path)
+            print(f"🔬 cProfile: {cprofile_path}", file=sys.stderr)
+        if profile_path:
+            PROFILER.write(profile_path, profile_format)
+            print(f"⏱️ Профиль стадий: {profile_path}", file=sys.stderr)
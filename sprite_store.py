@@ -0,0 +1,167 @@
+"""Хранилище спрайтов в сыром RGBA: один файл, отображаемый в память (mmap).
+
+Формат (little-endian):
+    заголовок  "SPRSTOR1", версия u32, число записей u32, смещение индекса u64
+    данные     пиксели спрайтов подряд, каждый с границы STORE_ALIGN байт
+    индекс     записи: sha256 (32 байта), смещение u64, ширина u32, высота u32
+
+Пиксели не надо распаковывать из PNG: массив спрайта — это view на
+отображённые страницы, а воркеры пула делят их через кэш ОС. Хэш — это
+содержимое спрайта, поэтому запись не устаревает; при пересборке старые
+записи копируются как есть, декодируются только новые спрайты.
+"""
+
+import os
+import mmap
+import struct
+from typing import Dict, Iterable, Optional, Tuple
+
+from PIL import Image
+
+from profiling import log
+
+try:
+    import numpy as np
+
+    NUMPY_AVAILABLE = True
+except ImportError:
+    NUMPY_AVAILABLE = False
+
+STORE_MAGIC = b"SPRSTOR1"
+STORE_VERSION = 1
+STORE_ALIGN = 64
+
+_HEADER = struct.Struct("<8sIIQ")
+_ENTRY = struct.Struct("<32sQII")
+
+
+def _aligned(offset: int) -> int:
+    return (offset + STORE_ALIGN - 1) // STORE_ALIGN * STORE_ALIGN
+
+
+class SpriteStore:
+    """Только чтение: hash -> пиксели спрайта без копирования."""
+
+    def __init__(self, path: str) -> None:
+        self.path = path
+        with open(path, "rb") as fh:
+            self._mm = mmap.mmap(fh.fileno(), 0, access=mmap.ACCESS_READ)
+        magic, version, entries, index_offset = _HEADER.unpack_from(self._mm, 0)
+        if magic != STORE_MAGIC or version != STORE_VERSION:
+            self._mm.close()
+            raise ValueError(f"{path}: не хранилище спрайтов версии {STORE_VERSION}")
+        self._index: Dict[str, Tuple[int, int, int]] = {}
+        for i in range(entries):
+            digest, offset, width, height = _ENTRY.unpack_from(self._mm, index_offset + i * _ENTRY.size)
+            self._index[digest.hex()] = (offset, width, height)
+
+    def close(self) -> None:
+        try:
+            self._mm.close()
+        except BufferError:
+            # Кто-то ещё держит view на страницы — отображение закроет сборщик
+            pass
+
+    def __contains__(self, sprite_hash: str) -> bool:
+        return sprite_hash in self._index
+
+    def __len__(self) -> int:
+        return len(self._index)
+
+    def hashes(self) -> Iterable[str]:
+        return self._index.keys()
+
+    def size(self, sprite_hash: str) -> Tuple[int, int]:
+        _offset, width, height = self._index[sprite_hash]
+        return width, height
+
+    def raw(self, sprite_hash: str) -> memoryview:
+        offset, width, height = self._index[sprite_hash]
+        return memoryview(self._mm)[offset:offset + width * height * 4]
+
+    def image(self, sprite_hash: str) -> Image.Image:
+        """RGBA-изображение поверх отображённой памяти (только для чтения)."""
+
+        width, height = self.size(sprite_hash)
+        return Image.frombuffer("RGBA", (width, height), self.raw(sprite_hash), "raw", "RGBA", 0, 1)
+
+    def array(self, sprite_hash: str) -> "np.ndarray":
+        """Массив (h, w, 4) — view на страницы файла, crop по нему тоже без копий."""
+
+        offset, width, height = self._index[sprite_hash]
+        pixels = np.frombuffer(self._mm, dtype=np.uint8, count=width * height * 4, offset=offset)
+        return pixels.reshape(height, width, 4)
+
+
+def build_sprite_store(path: str, hash_to_path: Dict[str, str]) -> Tuple[int, int]:
+    """Пишет хранилище для всех спрайтов hash_to_path, возвращает (из старого, декодировано).
+
+    Записи прежнего файла переносятся без декодирования, спрайты, которых
+    больше нет в индексе, выбрасываются. Файл заменяется атомарно, так что
+    уже открытые отображения продолжают читать старую версию.
+    """
+
+    old: Optional[SpriteStore] = None
+    if os.path.exists(path):
+        try:
+            old = SpriteStore(path)
+        except (OSError, ValueError, struct.error):
+            old = None
+
+    reused = decoded = 0
+    entries = []
+    tmp_path = path + ".tmp"
+    with open(tmp_path, "wb") as fh:
+        fh.write(b"\0" * _aligned(_HEADER.size))
+        for sprite_hash in sorted(hash_to_path):
+            if old is not None and sprite_hash in old:
+                width, height = old.size(sprite_hash)
+                data = old.raw(sprite_hash)
+                reused += 1
+            else:
+                try:
+                    with Image.open(hash_to_path[sprite_hash]) as sprite_img:
+                        rgba = sprite_img.convert("RGBA")
+                except Exception as e:
+                    log(f"⚠️ Не удалось прочитать {os.path.basename(hash_to_path[sprite_hash])}: {e}")
+                    continue
+                width, height = rgba.size
+                data = rgba.tobytes()
+                decoded += 1
+            offset = fh.tell()
+            fh.write(data)
+            fh.write(b"\0" * (_aligned(fh.tell()) - fh.tell()))
+            entries.append((bytes.fromhex(sprite_hash), offset, width, height))
+
+        index_offset = fh.tell()
+        for entry in entries:
+            fh.write(_ENTRY.pack(*entry))
+        fh.seek(0)
+        fh.write(_HEADER.pack(STORE_MAGIC, STORE_VERSION, len(entries), index_offset))
+
+    # data может быть последним memoryview на страницы старого файла — без
+    # него close() не выдаст BufferError и отображение действительно закроется
+    data = None
+    if old is not None:
+        old.close()
+    os.replace(tmp_path, path)
+    return reused, decoded
+
+
+def open_sprite_store(path: str, hash_to_path: Dict[str, str]) -> SpriteStore:
+    """Открывает хранилище, пересобирая его, если в нём нет спрайтов из индекса."""
+
+    store: Optional[SpriteStore] = None
+    if os.path.exists(path):
+        try:
+            store = SpriteStore(path)
+        except (OSError, ValueError, struct.error) as e:
+            log(f"⚠️ Хранилище спрайтов {path} повреждено, пересобираем: {e}")
+    if store is not None:
+        if all(sprite_hash in store for sprite_hash in hash_to_path):
+            return store
+        store.close()
+
+    reused, decoded = build_sprite_store(path, hash_to_path)
+    log(f"🗄️ Хранилище спрайтов {path}: перенесено {reused}, декодировано {decoded}")
+    return SpriteStore(path)